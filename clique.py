@@ -0,0 +1,1059 @@
+"""
+The simulation at the heart of Version 3 (the game itself, with its window
+and main loop, is clique_main_3.py).
+
+Importing this module has no side effects beyond setting up empty module
+state: no window is opened and nothing runs, so tools, worker processes and
+scripts can build and step worlds (see World) straight away. pygame isn't
+even imported until something is first drawn (see load_pygame).
+"""
+
+from __future__ import division, print_function
+import bisect, gc, math, random, struct, warnings
+from clique_spatial import SpatialGrid, fit_cell_size
+from clique_profile import Profiler
+from clique_sprites import SpriteCache, blit_all
+from clique_focus import FocusCache
+from clique_rules import RuleTable, pair_of
+from clique_lod import Scheduler, BANDS
+import clique_chunks
+from clique_chunks import ChunkStore, Pager
+from clique_record import Recorder
+import clique_snapshot
+
+RAND = random.Random()
+RAND.seed()
+
+DEBUG = False
+
+UP = 0
+DOWN = 1
+RIGHT = 2
+LEFT = 3
+STAY = 4
+DIRECTIONS = ['up', 'down', 'right', 'left', 'stay']
+
+PLAYER_MOVEMENT = 2
+OFFSET = [0, 0]
+
+SHAPE_TYPES = ['triangle', 'square', 'pentagon', 'hexagon', 'circle']
+SHAPE_SIDES = {
+    'circle': 1, 'hexagon': 6, 'pentagon': 5, 'square': 4, 'triangle': 3}
+SHAPE_MEAN = {
+    'circle': 35, 'hexagon': 40, 'pentagon': 45, 'square': 70, 'triangle': 80}
+SHAPE_DEV = {
+    'circle': 5, 'hexagon': 6, 'pentagon': 7, 'square': 9, 'triangle': 10}
+
+MAGIC_CONSTANT = 5 / (len(SHAPE_TYPES) - 1)
+# if the dividend is 1, all shape types (except circles) will be generated equally
+# if the dividend is > 1, the distribution of shapes will be skewed in favor
+#     of fewer sides.
+# if the dividend is >= the divisor, only triangles will be generated.
+
+STROKE_WIDTH = 1
+NUM_SHAPES = 50
+MAX_AGE = 10000
+
+# if False, shapes find their nearest neighbour by scanning the whole list of
+# shapes (the original O(n^2) behavior) instead of asking the spatial grid
+USE_GRID = True
+# the side of a cell in the grid, or None to fit it to the shapes when the
+# world is made (see clique_spatial.fit_cell_size): a fixed size that suits
+# a few hundred shapes leaves a crowd of thousands searching through packed
+# cells
+GRID_CELL_SIZE = None
+# if True (and USE_GRID is), a shape only searches the grid again once the
+# shape it focused on last time could have been overtaken by another one
+# (see clique_focus). It isn't used with LOD: any shape might catch up on
+# a whole period of missed steps at once, which shrinks every margin so far
+# that hardly a search is ever saved.
+FOCUS_CACHE = True
+
+# if True (and USE_GRID is), shapes far from the screen only move every few
+# ticks, but several steps at a time (see clique_lod); LOD_BANDS lists how
+# far from the screen each rate applies. Only the 'objects' engine does
+# this; the array engines move every shape every tick regardless (and World
+# warns about it).
+LOD = False
+LOD_BANDS = BANDS
+
+# if True, the world is divided into CHUNK_SIZE square chunks, and only
+# shapes within ACTIVE_CHUNKS chunks of the player's are kept in memory and
+# simulated; the rest are frozen and stored on disk until the player comes
+# back (see clique_chunks). Only the 'objects' engine does this; the array
+# engines keep every shape in memory regardless (and World warns about it).
+CHUNKS = False
+CHUNK_SIZE = 2000
+ACTIVE_CHUNKS = 1
+
+# if set, every tick of the game is recorded to this file (see clique_record;
+# doesn't work with CHUNKS, which changes the number of shapes in memory)
+RECORD_PATH = None
+# 'objects' runs the reference model (one Shape object deciding at a time);
+# 'numpy' runs the whole population as arrays in clique_numpy.ArrayEngine;
+# 'parallel' is the same, but the move phase is split across WORKERS
+# processes (None for one per cpu) by clique_parallel.ParallelEngine
+ENGINE = 'objects'
+WORKERS = None
+
+# if True, each (shape type, size, shade) is rasterized once and shapes are
+# blitted from the cache; if False, every shape is drawn with pygame.draw
+# every frame
+SPRITES = True
+# shapes come in ~255 shades and dozens of sizes, so a crowd of a few thousand
+# can easily need a few thousand different sprites; if the cache is smaller
+# than that, every frame evicts sprites that will be needed again the next
+# frame and nothing ever hits. The cache only grows as big as what's visible.
+SPRITE_CACHE_SIZE = 8192
+
+# pygame and the colors are set by load_pygame
+pygame = None
+BLACK = None
+WHITE = None
+# shapes only store their shade; these are shared by everyone for drawing
+GRAYS = []
+# the background of a sprite (no shape is ever this color)
+TRANSPARENT = None
+
+def load_pygame():
+    # import pygame and make the colors, if that hasn't been done yet.
+    # Everything that draws calls this first, so a world that is never drawn
+    # never loads pygame.
+    global pygame, BLACK, WHITE, GRAYS, TRANSPARENT
+    if pygame is None:
+        import pygame
+        BLACK = pygame.color.Color(0,0,0)
+        WHITE = pygame.color.Color(255,255,255)
+        GRAYS = [pygame.color.Color(shade, shade, shade)
+                 for shade in range(256)]
+        TRANSPARENT = pygame.color.Color(255,0,255)
+    return pygame
+
+def move_player(direction):
+    # modify offset in *opposite* direction
+    # (to keep "camera" centered on player)
+
+    if direction == UP:
+        OFFSET[1] += PLAYER_MOVEMENT
+    elif direction == DOWN:
+        OFFSET[1] -= PLAYER_MOVEMENT
+    elif direction == RIGHT:
+        OFFSET[0] -= PLAYER_MOVEMENT
+    elif direction == LEFT:
+        OFFSET[0] += PLAYER_MOVEMENT
+    else:
+        return
+
+    if focus_cache is not None:
+        focus_cache.player_moved(PLAYER_MOVEMENT)
+
+class Shape(object):
+    # there can be a great many shapes, so they don't get a __dict__; pos and
+    # nextpos are [x, y] lists that are updated in place. Shapes don't keep
+    # vertices of their own: every shape of the same type and size shares
+    # one template, centred on (0, 0) (see template)
+    __slots__ = ('pos', 'nextpos', 'focus', 'focusdist', 'shape_type',
+                 'side_length', 'shade', 'persona', 'age', 'updated')
+
+    # state of a subclass's own that has to be kept when the shape is saved
+    # in a snapshot or paged out to disk, as (name, array typecode) pairs;
+    # extra_values returns it in this order and restore takes it back. The
+    # typecodes must also be struct format characters (e.g. 'i', 'H', 'B').
+    EXTRA_COLUMNS = []
+
+    # the engines (see ENGINE) that can move shapes of this class. The array
+    # engines only know these rules, so a subclass with rules of its own
+    # has to set this to ['objects'].
+    ENGINES = ['objects', 'numpy', 'parallel']
+
+    def __init__(self, position, shape_type, side_length, shade, persona, age):
+        self.pos = [position[0], position[1]]
+        self.nextpos = [position[0], position[1]]
+        self.focus = None
+        self.focusdist = None
+        self.shape_type = shape_type
+        self.side_length = side_length # for circles, side_length = radius
+        self.shade = shade # 0 (black) to 255 (white, only for the player)
+        self.persona = persona
+        self.age = age
+        self.updated = lod_tick() # the last tick it moved on (see clique_lod)
+
+    def move(self, steps=1):
+        # steps is how many pixels to move (shapes that the LOD scheduler
+        # has let skip some ticks make up for them all at once)
+        xpos = self.pos[0]
+        ypos = self.pos[1]
+
+        # find the nearest shape and focus attention on it
+        if USE_GRID:
+            nearest, location = find_nearest(self, xpos, ypos)
+        else:
+            nearest = None
+            location = None
+            for shape in shapes:
+                if shape == player:
+                    xdist = xpos - (shape.pos[0] - OFFSET[0])
+                    ydist = ypos - (shape.pos[1] - OFFSET[1])
+                else:
+                    xdist = xpos - shape.pos[0]
+                    ydist = ypos - shape.pos[1]
+
+                totaldist = abs(xdist) + abs(ydist)
+
+                if ((nearest == None or totaldist < location[2])
+                    and shape != self
+                    ):
+                    nearest = shape
+                    location = (xdist, ydist, totaldist)
+        self.focus = nearest
+        self.focusdist = location
+
+        direction = self.where_to(nearest, location)
+
+        if   direction == UP:    self.nextpos[1] -= steps
+        elif direction == DOWN:  self.nextpos[1] += steps
+        elif direction == RIGHT: self.nextpos[0] += steps
+        elif direction == LEFT:  self.nextpos[0] -= steps
+        # if direction == STAY:  do nothing
+
+    def where_to(self, nearest, location):
+        # the rules (see clique_rules.rule_votes) only depend on the two
+        # types, the shade difference, personal space and which way the
+        # nearest shape is, so every possible vote array is in RULES already;
+        # position in the array correlates to direction constant
+        kind = SHAPE_INDEX[self.shape_type]
+        votes = (RULES.votes[kind][SHAPE_INDEX[nearest.shape_type]]
+                 [RULES.buckets[kind][abs(self.shade - nearest.shade)]]
+                 [location[2] < self.persona.personal_space]
+                 [pair_of(location[0], location[1])])
+        return best_dir(votes)
+
+    # end where_to()
+
+    def update(self):
+        self.update_position()
+        self.age += 1
+        if self.age > MAX_AGE:
+            profiler.start('respawn')
+            self.respawn()
+            profiler.stop('respawn')
+
+    def respawn(self):
+        # this shape dies and a brand new one takes its place in the list of
+        # shapes. Recycling the object in place, rather than removing it from
+        # the list and appending a new one, keeps retirement O(1), doesn't
+        # make whoever is looping over the shapes skip the next one, and
+        # saves allocating a new Shape, Color and Personality every time.
+        position, shape_type, side_length, shade, age = random_traits()
+
+        self.pos[0] = self.nextpos[0] = position[0]
+        self.pos[1] = self.nextpos[1] = position[1]
+
+        self.focus = None
+        self.focusdist = None
+        self.shape_type = shape_type
+        self.side_length = side_length
+        self.shade = shade
+        self.persona = PERSONALITIES[shape_type]
+        self.age = age
+        # (it hasn't missed any turns, whenever the one it replaces last
+        # moved)
+        self.updated = lod_tick()
+        if focus_cache is not None:
+            focus_cache.spawned(self, self.pos[0], self.pos[1])
+
+    def render(self, surface):
+        load_pygame()
+
+        if DEBUG: self.draw_line_to_focus(surface)
+
+        if self == player:
+            pygame.draw.circle(surface, GRAYS[self.shade], self.pos,
+                               self.side_length)
+            pygame.draw.circle(surface, BLACK, self.pos,
+                               self.side_length, STROKE_WIDTH)
+        else:
+            xpos = self.pos[0] + OFFSET[0]
+            ypos = self.pos[1] + OFFSET[1]
+
+            # if the shape isn't visible, don't bother drawing it
+            if self.onscreen():
+
+                if self.shape_type == 'circle':
+                    pygame.draw.circle(surface, GRAYS[self.shade], (xpos, ypos),
+                                       self.side_length)
+                    pygame.draw.circle(surface, BLACK, (xpos, ypos),
+                                       self.side_length, STROKE_WIDTH)
+
+                else: # praw a polygon centered at self.pos
+                    points = translate(template(self.shape_type,
+                                                self.side_length),
+                                       xpos, ypos)
+                    pygame.draw.polygon(surface, GRAYS[self.shade], points)
+                    pygame.draw.polygon(surface, BLACK, points, STROKE_WIDTH)
+
+            #else: print("This shape (of type ", self.shape_type, ") is offscreen")
+
+    def onscreen(self):
+        xpos = self.pos[0] + OFFSET[0]
+        ypos = self.pos[1] + OFFSET[1]
+        return not (xpos > size[0] + self.side_length or
+                    xpos <          -self.side_length or
+                    ypos > size[1] + self.side_length or
+                    ypos <          -self.side_length)
+
+    def sprite(self):
+        # (sprite, screen position) to blit for this shape
+        image, anchor = sprites.get(
+            (self.shape_type, self.side_length, self.shade))
+        return image, (self.pos[0] + OFFSET[0] - anchor[0],
+                       self.pos[1] + OFFSET[1] - anchor[1])
+
+    # for debugging
+    def draw_line_to_focus(self, surface):
+        focus = self.focus
+
+        if focus != None:
+            if self == player:
+                x1 = self.pos[0]
+                y1 = self.pos[1]
+            else:
+                x1 = self.pos[0] + OFFSET[0]
+                y1 = self.pos[1] + OFFSET[1]
+
+            if focus == player:
+                x2 = focus.pos[0]
+                y2 = focus.pos[1]
+            else:
+                x2 = focus.pos[0] + OFFSET[0]
+                y2 = focus.pos[1] + OFFSET[1]
+
+            x3 = x1
+            y3 = y1 - 10
+
+            pygame.draw.line(surface, BLACK, (x1, y1), (x2, y2))
+            pygame.draw.line(surface, BLACK, (x2, y2), (x3, y3))
+
+    def update_position(self):
+        self.pos[0] = self.nextpos[0]
+        self.pos[1] = self.nextpos[1]
+
+    def extra_values(self):
+        # (see EXTRA_COLUMNS)
+        return ()
+
+    @classmethod
+    def restore(cls, position, shape_type, side_length, shade, age, extra):
+        # a shape as it was saved, with extra holding the values of
+        # EXTRA_COLUMNS
+        return cls(position, shape_type, side_length, shade,
+                   PERSONALITIES[shape_type], age)
+
+# end class Shape
+
+def lod_tick():
+    # the LOD scheduler's current tick (0 without one): shapes that come into
+    # the world take their first turn as though they had moved on it
+    return scheduler.tick if scheduler is not None else 0
+
+def index_shapes():
+    # rebuild the spatial grid from the shapes' current positions, in the
+    # order of the list of shapes. The cells are sized the first time, and
+    # keep that size from then on. The player can move at any time, so
+    # index_player adds it just before the move phase.
+    global indexed_player
+    entries = [(shape, shape.pos[0], shape.pos[1], shape.side_length)
+               for shape in shapes if shape != player]
+    cell_size = grid.cell_size
+    if cell_size is None:
+        cell_size = GRID_CELL_SIZE
+    if cell_size is None:
+        cell_size = fit_cell_size([entry[1] for entry in entries],
+                                  [entry[2] for entry in entries])
+    grid.rebuild(entries, cell_size)
+    indexed_player = None
+
+def reindex_shapes():
+    # bring the grid up to date with the shapes that moved (or respawned).
+    # Shapes only ever move in the age phase, so this is done at the end of
+    # it, and the grid is ready both for drawing and for the next move phase
+    # (where shapes only look at each other's old positions). Each shape
+    # keeps its place in the grid's order, so the list of shapes must be the
+    # same one that was last indexed.
+    if scheduler is not None:
+        # (only shapes that took a turn, or were born, this tick can have
+        # moved)
+        tick = scheduler.tick
+        for shape in shapes:
+            if shape.updated == tick and shape != player:
+                grid.move(shape, shape.pos[0], shape.pos[1], shape.side_length)
+    else:
+        for shape in shapes:
+            if shape != player:
+                grid.move(shape, shape.pos[0], shape.pos[1], shape.side_length)
+
+def index_player():
+    # (re)place the player in the grid, after all the shapes, so it loses
+    # ties just as it did at the end of the list of shapes. It is stored in
+    # world coordinates (its pos is in screen coordinates, so OFFSET has to
+    # be taken back out).
+    global indexed_player
+    if indexed_player is not None:
+        grid.remove(player, indexed_player[0], indexed_player[1])
+    indexed_player = grid_position(player)
+    grid.insert(player, indexed_player[0], indexed_player[1])
+
+def grid_position(shape):
+    # where index_shapes put this shape
+    if shape == player:
+        return (shape.pos[0] - OFFSET[0], shape.pos[1] - OFFSET[1])
+    return shape.pos
+
+def find_nearest(shape, xpos, ypos):
+    if focus_cache is not None:
+        found = focus_cache.nearest(shape, xpos, ypos)
+    else:
+        found = grid.nearest(xpos, ypos, exclude=shape)
+    if found is None:
+        return None, None
+    return found[0], found[1:]
+
+def best_dir(votes):
+    # each direction is picked with probability proportional to its votes.
+    # The votes are numbered from the top, total down to 1, and the
+    # direction owning the first number <= position wins; that is the first
+    # direction whose *last* number is <= position, so there is no need to
+    # count through the votes one by one.
+    total = 0
+    for vote in votes: total += vote
+    position = (RAND.random() * total) + 1
+    countdown = total + 1
+    for i in range(len(votes)):
+        countdown -= votes[i]
+        if votes[i] and countdown <= position: return i
+    assert False #the loop should always return before termination
+    """
+    maxpos = 0
+    maxval = votes[0]
+    for i in range(1, len(votes)):
+        if votes[i] >= maxval:
+            maxpos = i
+            maxval = votes[i]
+    return maxpos
+    """
+
+"""
+xdist = xpos - shape.pos[0]
+ydist = ypos - shape.pos[1]
+
+If xdist is positive, they are to the left of me.
+If xdist is negative, they are to the right of me.
+If ydist is positive, they are above me.
+If ydist is negative, they are below me.
+I will reduce the axis of greatest distance if I want to get closer.
+I will increase the axis of greatest distance if I want to get further.
+OR
+#I will randomly choose an axis to travel along.
+"""
+def closer(xdist, ydist):
+    if xdist == ydist == 0:
+        return STAY
+    #if RAND.random() < 0.5:
+    if abs(xdist) > abs(ydist):
+        # move along the x axis
+        if xdist > 0:
+            return LEFT
+        else:
+            return RIGHT
+    else:
+        # move along the y axis
+        if ydist > 0:
+            return UP
+        else:
+            return DOWN
+
+def further(xdist, ydist):
+    #if RAND.random() < 0.5:
+    if abs(xdist) > abs(ydist):
+        # move along the x axis
+        if xdist > 0:
+            return RIGHT
+        else:
+            return LEFT
+    else:
+        # move along the y axis
+        if ydist > 0:
+            return DOWN
+        else:
+            return UP
+
+
+class Personality(object):
+    # every shape of a given type has the same personality, so they share one
+    # (see PERSONALITIES)
+    __slots__ = ('shade_preferance', 'shade_tolerance', 'personal_space')
+
+    def __init__(self, shape_type):
+        self.shade_preferance = 50
+        self.shade_tolerance = 150
+        #self.size_tolerance = int(RAND.gauss(SHAPE_MEAN[shape_type] / 2,
+                                             #SHAPE_DEV[shape_type] / 2))
+        self.personal_space = SHAPE_MEAN[shape_type]
+
+# end class Personality
+
+PERSONALITIES = dict((shape_type, Personality(shape_type))
+                     for shape_type in SHAPE_TYPES)
+SHAPE_INDEX = dict((shape_type, i) for i, shape_type in enumerate(SHAPE_TYPES))
+RULES = RuleTable(SHAPE_TYPES, PERSONALITIES)
+
+def makepoints(position, shape_type, side_length):
+    halfside = side_length / 2
+
+    if shape_type == 'circle':
+        return None
+
+    elif shape_type == 'triangle':
+        h = math.sqrt(side_length**2 - (side_length/2)**2)
+        apothem = h / 2
+        top = [position[0], position[1] - apothem]
+        botleft = [position[0] - halfside, position[1] + apothem]
+        botright = [position[0] + halfside, position[1] + apothem]
+        return (top, botleft, botright)
+
+    elif shape_type == 'square':
+        topleft = [position[0] - halfside, position[1] - halfside]
+        topright = [topleft[0] + side_length, topleft[1]]
+        botleft = [topleft[0], topleft[1] + side_length]
+        botright = [topright[0], topright[1] + side_length]
+        return (topleft, topright, botright, botleft)
+
+    else:
+        numsides = SHAPE_SIDES[shape_type]
+        apothem = side_length / (2 * math.tan(math.pi / numsides))
+
+        angle = ((numsides - 2) * math.pi) / (numsides * 2)
+        xoffset = side_length * math.sin(angle)
+        yoffset = side_length * math.cos(angle)
+        radius = math.sqrt(halfside**2 + apothem**2)
+
+        if shape_type == 'pentagon':
+            top = [position[0], position[1] - radius]
+            second = [position[0] + xoffset, top[1] + yoffset]
+            third = [position[0] + halfside, position[1] + apothem]
+            fourth = [position[0] - halfside, position[1] + apothem]
+            fifth = [position[0] - xoffset, top[1] + yoffset]
+            return (top, second, third, fourth, fifth)
+
+        elif shape_type == 'hexagon':
+            topleft = [position[0] - halfside, position[1] - apothem]
+            topright = [position[0] + halfside, position[1] - apothem]
+            right = [position[0] + radius, position[1]]
+            botright = [position[0] + halfside, position[1] + apothem]
+            botleft = [position[0] - halfside, position[1] + apothem]
+            left = [position[0] - radius, position[1]]
+            return (topleft, topright, right, botright, botleft, left)
+
+        else:
+            print('unkown shape, type:', shape_type)
+            assert False
+
+# end makepoints()
+
+TEMPLATES = {} # (shape type, side length): vertices
+
+def template(shape_type, side_length):
+    # the vertices of every shape of this type and size, centred on (0, 0)
+    # and worked out only once; None for circles. They are rounded off a
+    # little, so that one that ought to be a whole number (but came out as
+    # -14.000000000000002, say) falls on the same pixel wherever the shape
+    # is drawn, in place or on a sprite.
+    key = (shape_type, side_length)
+    points = TEMPLATES.get(key)
+    if points is None and key not in TEMPLATES:
+        points = makepoints((0, 0), shape_type, side_length)
+        if points is not None:
+            points = tuple((round(point[0], 9), round(point[1], 9))
+                           for point in points)
+        TEMPLATES[key] = points
+    return points
+
+def translate(points, xpos, ypos):
+    # a template's vertices, centred on (xpos, ypos) instead
+    return [(x + xpos, y + ypos) for x, y in points]
+
+def choose_shape():
+    for shape_type in SHAPE_TYPES:
+        if shape_type == 'hexagon':
+            return shape_type
+        elif RAND.random() < MAGIC_CONSTANT:
+            return shape_type
+
+def random_traits():
+    # (position, shape_type, side_length, shade, age) for a newborn shape
+    age = 0
+
+    shade = 255
+    while shade == 255: # only the player may be white
+        shade = RAND.randint(0,255)
+    x = RAND.randint(-50,size[0]+50) - OFFSET[0]
+    y = RAND.randint(-50,size[1]+50) - OFFSET[1]
+    # new shapes always appear onscreen - problem?
+
+    shape_type = choose_shape()
+    shape_size = 0
+    while shape_size <= 0:
+        shape_size = RAND.gauss(SHAPE_MEAN[shape_type], SHAPE_DEV[shape_type])
+
+    return (x,y), shape_type, int(shape_size), shade, age
+
+def freeze_shape(shape):
+    # a shape as a clique_chunks record (see chunk_record)
+    return (shape.pos[0], shape.pos[1], SHAPE_INDEX[shape.shape_type],
+            shape.side_length, shape.shade, shape.age) + \
+           tuple(shape.extra_values())
+
+def chunk_record(shape_class):
+    # the struct that shapes of this class are frozen into
+    return struct.Struct(clique_chunks.RECORD.format +
+                         ''.join(typecode for name, typecode
+                                 in shape_class.EXTRA_COLUMNS))
+
+def type_chances():
+    # the chance of choose_shape picking each of SHAPE_TYPES: every type up
+    # to the hexagon is picked with chance MAGIC_CONSTANT if none before it
+    # was, and the hexagon gets whatever is left
+    chances = []
+    left = 1
+    for shape_type in SHAPE_TYPES:
+        if shape_type == 'hexagon':
+            chance = left
+        else:
+            chance = left * min(max(MAGIC_CONSTANT, 0), 1)
+        chances.append(chance)
+        left -= chance
+    return chances
+
+def generate_shapes(num_shapes=None, shape_class=Shape):
+    # the whole population at once: each trait is drawn for every shape in
+    # one pass, with the same distributions as random_traits (but ages
+    # anywhere up to MAX_AGE) and without its retry loops (types come
+    # straight from type_chances, and shades from the 255 allowed ones), and
+    # the shapes are built last.
+    # num_shapes defaults to NUM_SHAPES.
+    if num_shapes is None: num_shapes = NUM_SHAPES
+    random = RAND.random
+    gauss = RAND.gauss
+    shape_range = range(num_shapes)
+
+    # (types after the last one with any chance are never picked, however
+    # the sums round)
+    chances = type_chances()
+    last = max(i for i, chance in enumerate(chances) if chance > 0)
+    cumulative = []
+    total = 0
+    for i, chance in enumerate(chances):
+        total += chance
+        cumulative.append(total if i < last else 1)
+    shape_types = [SHAPE_TYPES[bisect.bisect_right(cumulative, random())]
+                   for i in shape_range]
+
+    sizes = []
+    for shape_type in shape_types:
+        mean = SHAPE_MEAN[shape_type]
+        dev = SHAPE_DEV[shape_type]
+        shape_size = gauss(mean, dev)
+        while shape_size <= 0:
+            shape_size = gauss(mean, dev)
+        sizes.append(int(shape_size))
+
+    shades = [int(random() * 255) for i in shape_range]
+    left = -50 - OFFSET[0]
+    top = -50 - OFFSET[1]
+    width = size[0] + 101
+    height = size[1] + 101
+    xs = [left + int(random() * width) for i in shape_range]
+    ys = [top + int(random() * height) for i in shape_range]
+    ages = [int(random() * MAX_AGE) for i in shape_range]
+
+    # every shape brings two new lists with it, so building a big crowd
+    # would set off the cyclic garbage collector over and over, scanning
+    # everything built so far each time; none of it can be garbage yet
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        return [shape_class((x, y), shape_type, side_length, shade,
+                            PERSONALITIES[shape_type], age)
+                for x, y, shape_type, side_length, shade, age
+                in zip(xs, ys, shape_types, sizes, shades, ages)]
+    finally:
+        if collecting:
+            gc.enable()
+
+def restore_shapes(saved, shape_class=Shape):
+    # the shapes of a clique_snapshot.Snapshot, with the player (who must
+    # already exist) at the end
+    assert saved.extra_columns == list(shape_class.EXTRA_COLUMNS), \
+        'snapshot was saved from shapes of another class'
+    columns = saved.columns
+    extras = zip(*[columns[name] for name, typecode
+                   in shape_class.EXTRA_COLUMNS])
+    if not shape_class.EXTRA_COLUMNS:
+        extras = [()] * len(saved)
+    restored = []
+    for x, y, nextx, nexty, kind, side_length, shade, age, updated, extra \
+            in zip(columns['x'], columns['y'], columns['nextx'],
+                   columns['nexty'], columns['kind'], columns['side'],
+                   columns['shade'], columns['age'], columns['updated'],
+                   extras):
+        shape = shape_class.restore((x, y), SHAPE_TYPES[kind], side_length,
+                                    shade, age, extra)
+        shape.nextpos[0] = nextx
+        shape.nextpos[1] = nexty
+        shape.updated = updated
+        restored.append(shape)
+    restored.append(player)
+    for shape, focus in zip(restored, columns['focus']):
+        if focus >= 0:
+            shape.focus = restored[focus]
+    return restored
+
+def rasterize(key):
+    # draw a shape onto a sprite of its own, for the sprite cache; the anchor
+    # is where the shape's position falls on the sprite. Anchors are whole
+    # pixels, so a blitted shape gets exactly the same vertices as if it had
+    # been drawn in place.
+    load_pygame()
+    shape_type, side_length, shade = key
+    pad = STROKE_WIDTH + 1
+
+    if shape_type == 'circle':
+        anchor = (side_length + pad, side_length + pad)
+        image = pygame.Surface((2 * anchor[0] + 1, 2 * anchor[1] + 1))
+        image.fill(TRANSPARENT)
+        pygame.draw.circle(image, GRAYS[shade], anchor, side_length)
+        pygame.draw.circle(image, BLACK, anchor, side_length, STROKE_WIDTH)
+
+    else:
+        points = template(shape_type, side_length)
+        left = int(math.floor(min(point[0] for point in points))) - pad
+        top = int(math.floor(min(point[1] for point in points))) - pad
+        right = int(math.ceil(max(point[0] for point in points))) + pad
+        bottom = int(math.ceil(max(point[1] for point in points))) + pad
+        anchor = (-left, -top)
+        points = translate(points, -left, -top)
+
+        image = pygame.Surface((right - left + 1, bottom - top + 1))
+        image.fill(TRANSPARENT)
+        pygame.draw.polygon(image, GRAYS[shade], points)
+        pygame.draw.polygon(image, BLACK, points, STROKE_WIDTH)
+
+    image.set_colorkey(TRANSPARENT)
+    if pygame.display.get_surface() is not None:
+        # blitting is quicker in the screen's own pixel format
+        image = image.convert()
+    return image, anchor
+
+def make_player():
+    return Shape( (int(size[0]/2), int(size[1]/2)),
+                  'circle',
+                  25,
+                  255,
+                  None,
+                  None )
+
+def make_engine(kind):
+    if kind == 'numpy':
+        from clique_numpy import ArrayEngine
+        return ArrayEngine(shapes, player, SHAPE_TYPES, MAX_AGE, OFFSET, RULES,
+                           seed=RAND.getrandbits(32))
+    elif kind == 'parallel':
+        from clique_parallel import ParallelEngine
+        return ParallelEngine(shapes, player, SHAPE_TYPES, MAX_AGE, OFFSET,
+                              RULES, seed=RAND.getrandbits(32),
+                              workers=WORKERS)
+    elif kind == 'objects':
+        return None
+    else:
+        print('unknown engine:', kind)
+        assert False
+
+
+class World(object):
+    # A population of shapes plus the player, which can be stepped forward
+    # with no window, timer or drawing (e.g. World(5000, seed=1).step(1000)).
+    #
+    # Shapes find each other through the module-level shapes, player and
+    # size variables, so there is only ever one live world: creating a World
+    # replaces whatever population was there before and re-centers OFFSET.
+    #
+    # shape_class may be a subclass of Shape with different decision rules,
+    # such as the policies in clique_policies, as long as the engine can run
+    # them (see Shape.ENGINES).
+    #
+    # A world saved with save() can be carried on with
+    # World(snapshot_path=path); num_shapes, screen_size and seed are then
+    # taken from the snapshot instead. It has to be the same shape_class the
+    # world was saved with, since that decides which per-shape state was
+    # saved alongside (see Shape.EXTRA_COLUMNS).
+    def __init__(self, num_shapes=None, screen_size=(1200, 900),
+                 seed=None, engine=None, shape_class=Shape,
+                 record_path=None, snapshot_path=None):
+        # num_shapes, engine and record_path default to NUM_SHAPES, ENGINE
+        # and RECORD_PATH as they are when the world is made
+        global shapes, player, size, grid, indexed_player, focus_cache
+        global scheduler
+        # (the last world's are gone before any shapes are made)
+        grid = SpatialGrid(None) # (index_shapes sizes the cells)
+        indexed_player = None
+        focus_cache = None
+        scheduler = None
+        sprites.resize(SPRITE_CACHE_SIZE)
+        if num_shapes is None: num_shapes = NUM_SHAPES
+        if engine is None: engine = ENGINE
+        if record_path is None: record_path = RECORD_PATH
+        assert engine in shape_class.ENGINES, \
+            "engine %r can't run %s" % (engine, shape_class.__name__)
+        saved = None
+        if snapshot_path is not None:
+            saved = clique_snapshot.load(snapshot_path)
+            screen_size = saved.size
+        elif seed is not None:
+            RAND.seed(seed)
+        OFFSET[0] = OFFSET[1] = 0
+        size = screen_size
+
+        player = make_player()
+        if saved is not None:
+            OFFSET[0], OFFSET[1] = saved.offset
+            shapes = restore_shapes(saved, shape_class)
+        else:
+            shapes = generate_shapes(num_shapes, shape_class)
+            shapes.append(player)
+
+        self.player = player
+        self.shapes = shapes
+        self.shape_class = shape_class
+        self.engine = make_engine(engine)
+        self.ticks = 0
+        if saved is not None:
+            # (after make_engine, which draws the engine's seed from RAND)
+            RAND.setstate(saved.rand_state)
+            if self.engine is not None and saved.engine_state is not None:
+                self.engine.rng.bit_generator.state = saved.engine_state
+            self.ticks = saved.ticks
+
+        if self.engine is not None:
+            ignored = [name for name, value in [('LOD', LOD),
+                                                ('CHUNKS', CHUNKS)] if value]
+            if ignored:
+                warnings.warn("the %r engine ignores %s" %
+                              (engine, ' and '.join(ignored)), stacklevel=2)
+
+        self.pager = None
+        if self.engine is None and CHUNKS:
+            # (the recording holds the same number of shapes every tick)
+            assert record_path is None, "can't record a world paged to disk"
+            store = ChunkStore(record=chunk_record(shape_class))
+            self.pager = Pager(store, freeze_shape, self.thaw_shape,
+                               CHUNK_SIZE, ACTIVE_CHUNKS)
+
+        if self.engine is None and USE_GRID:
+            index_shapes()
+            if LOD:
+                scheduler = Scheduler(LOD_BANDS)
+                if saved is not None: scheduler.tick = saved.lod_tick
+            elif FOCUS_CACHE:
+                focus_cache = FocusCache(grid, grid_position)
+
+        self.recorder = None
+        if record_path is not None:
+            self.recorder = Recorder(record_path, len(shapes) - 1, size)
+            self.record()
+
+    def tick(self, surface=None):
+        # advance one timestep, then draw the shapes where they ended up if
+        # given a surface
+        self.advance()
+        if surface is not None: self.draw_shapes(surface)
+
+    def advance(self):
+        # one timestep, without drawing anything. The phases must run
+        # consecutively because shapes calculate new positions based on the
+        # old positions of other shapes; discrete timesteps are maintained
+        # with the Shape.pos and Shape.nextpos variables. A shape's actual
+        # position is only updated in its update method, which runs once
+        # everyone has decided where to go.
+        profiler.start('move')
+        self.move_shapes()
+        profiler.stop('move')
+
+        # (includes the respawn phase)
+        profiler.start('age')
+        self.age_shapes()
+        profiler.stop('age')
+
+        self.ticks += 1
+        self.record()
+
+    def move_shapes(self):
+        if self.engine is not None:
+            self.engine.move()
+        else:
+            if USE_GRID: index_player()
+            if focus_cache is not None: focus_cache.begin_tick()
+            if scheduler is not None:
+                viewport = (-OFFSET[0], -OFFSET[1],
+                            size[0] - OFFSET[0], size[1] - OFFSET[1])
+                for shape, steps in scheduler.due(shapes, grid, viewport,
+                                                  exclude=player):
+                    shape.move(steps)
+            else:
+                for shape in shapes:
+                    if shape != player: shape.move()
+
+    def visible_shapes(self):
+        # the shapes on the screen, apart from the player
+        if self.engine is not None:
+            # only the shapes that will be drawn are brought up to date
+            return self.engine.sync(self.engine.visible(size))
+        elif USE_GRID:
+            # only the part of the grid under the screen is looked at
+            nearby = grid.query_rect(-OFFSET[0], -OFFSET[1],
+                                     size[0] - OFFSET[0], size[1] - OFFSET[1])
+            return [shape for shape in nearby
+                    if shape != player and shape.onscreen()]
+        else:
+            return [shape for shape in shapes
+                    if shape != player and shape.onscreen()]
+
+    def draw_shapes(self, surface):
+        # the player isn't included; it should always be on top, so it
+        # gets rendered last, by whoever owns the screen
+        load_pygame()
+        drawn = self.visible_shapes()
+
+        if SPRITES:
+            blit_all(surface, [shape.sprite() for shape in drawn])
+            if DEBUG:
+                for shape in drawn: shape.draw_line_to_focus(surface)
+        else:
+            for shape in drawn: shape.render(surface)
+
+    def age_shapes(self):
+        if self.engine is not None:
+            self.engine.age_shapes(profiler)
+        else:
+            for shape in shapes:
+                if shape != player: shape.update()
+            if self.pager is not None and self.page():
+                # (a new list of shapes)
+                if USE_GRID: index_shapes()
+            elif USE_GRID:
+                reindex_shapes()
+
+    def page(self):
+        # swap chunks in and out of memory around the player, if it's time;
+        # returns whether it was. The player stays at the end of the list of
+        # shapes.
+        x, y = grid_position(player)
+        if not self.pager.due(x, y):
+            return False
+        shapes[:-1] = self.pager.page(shapes[:-1], x, y)
+        # (cached foci may have been frozen)
+        if focus_cache is not None: focus_cache.clear()
+        return True
+
+    def columns(self):
+        # the population (not the player) as columns, one value per shape:
+        # (x, y, focus, kind, side, shade, age), where kind is the index of
+        # the shape type, and focus the index of the focused shape, the
+        # number of shapes for the player, or -1 for nobody
+        if self.engine is not None:
+            return self.engine.columns()
+        population = shapes[:-1]
+        index = dict((shape, i) for i, shape in enumerate(shapes))
+        return ([shape.pos[0] for shape in population],
+                [shape.pos[1] for shape in population],
+                [index.get(shape.focus, -1) for shape in population],
+                [SHAPE_INDEX[shape.shape_type] for shape in population],
+                [shape.side_length for shape in population],
+                [shape.shade for shape in population],
+                [shape.age for shape in population])
+
+    def record(self):
+        # add the current tick to the recording, if there is one
+        if self.recorder is not None:
+            self.recorder.record(self.ticks, grid_position(player),
+                                 *self.columns())
+
+    def snapshot(self):
+        # everything needed to carry on from here, as a
+        # clique_snapshot.Snapshot (shapes stored in chunks aren't included)
+        assert self.pager is None, "can't snapshot a world paged to disk"
+        engine_state = None
+        if self.engine is not None:
+            # bring every Shape object up to date with the arrays
+            self.engine.sync(range(len(self.engine.shapes)))
+            engine_state = self.engine.rng.bit_generator.state
+        population = shapes[:-1]
+        index = dict((shape, i) for i, shape in enumerate(shapes))
+        columns = {
+            'x': [shape.pos[0] for shape in population],
+            'y': [shape.pos[1] for shape in population],
+            'nextx': [shape.nextpos[0] for shape in population],
+            'nexty': [shape.nextpos[1] for shape in population],
+            'kind': [SHAPE_INDEX[shape.shape_type] for shape in population],
+            'side': [shape.side_length for shape in population],
+            'shade': [shape.shade for shape in population],
+            'age': [shape.age for shape in population],
+            'focus': [index.get(shape.focus, -1) for shape in population],
+            'updated': [shape.updated for shape in population]}
+        extra_columns = self.shape_class.EXTRA_COLUMNS
+        extras = [shape.extra_values() for shape in population]
+        for i, (name, typecode) in enumerate(extra_columns):
+            columns[name] = [values[i] for values in extras]
+        lod_tick = scheduler.tick if scheduler is not None else 0
+        return clique_snapshot.Snapshot(size, OFFSET, self.ticks, lod_tick,
+                                        RAND.getstate(), engine_state,
+                                        columns, extra_columns)
+
+    def save(self, path):
+        self.snapshot().save(path)
+
+    def thaw_shape(self, record):
+        x, y, kind, side_length, shade, age = record[:6]
+        return self.shape_class.restore((x, y), SHAPE_TYPES[kind],
+                                        side_length, shade, age, record[6:])
+
+    def step(self, n=1):
+        for i in range(n):
+            self.tick()
+
+    def close(self):
+        # release whatever the world holds outside this process (worker
+        # processes, shared memory, stored chunks)
+        if hasattr(self.engine, 'close'):
+            self.engine.close()
+        if self.pager is not None:
+            self.pager.close()
+        if self.recorder is not None:
+            self.recorder.close()
+
+# end class World
+
+
+
+size = (1200, 900)
+
+# the current world's population (see World)
+player = None
+shapes = []
+grid = None # made by World, and sized by index_shapes
+indexed_player = None # where index_player put the player
+focus_cache = None
+scheduler = None
+profiler = Profiler()
+# (shared by every world and the replay viewer, which resize it to
+# SPRITE_CACHE_SIZE as it is when they start)
+sprites = SpriteCache(rasterize, SPRITE_CACHE_SIZE)
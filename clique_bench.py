@@ -0,0 +1,192 @@
+"""
+Benchmarks for the tick loop.
+
+Builds worlds of a given size from a fixed seed and runs them for a fixed
+number of ticks the way the fixed-timestep loop in clique_main_3.main does:
+each tick is one World.advance(), followed by a frame drawn (to an offscreen
+surface) of where the shapes ended up, as if the game never had to catch up.
+Reports ticks/second, the time spent in each phase (as timed by the same
+profiler the game uses) and the memory taken up by the world.
+
+All three decision policies (see clique_policies) can be measured on the
+same world, renderer and spatial grid. To compare how they behave as well as
+how fast, each run also reports how spread out the shapes ended up: the mean
+distance from a shape to its nearest neighbour.
+
+    python clique_bench.py --shapes 50,500,2000 --ticks 200
+    python clique_bench.py --save before.json
+    python clique_bench.py --baseline before.json   # exits 1 on a regression
+"""
+
+from __future__ import division, print_function
+import argparse, gc, json, sys, time, tracemalloc
+import pygame
+import clique
+from clique_policies import POLICIES, ENGINES
+from clique_spatial import SpatialGrid, fit_cell_size
+from clique_profile import Profiler
+
+clock = getattr(time, 'perf_counter', time.time)
+
+SEED = 1
+TICKS = 100
+TOLERANCE = 0.2 # fraction of the baseline ticks/second allowed to go missing
+
+
+def warm_up(version, engine, seed=SEED):
+    # build, run and close a tiny world first, so that whatever the engine
+    # imports or sets up lazily (numpy, its random generators, shared memory
+    # for the worker processes, ...) is already there and isn't counted as
+    # memory taken up by the world being measured, however the runs are
+    # ordered
+    world = clique.World(2, seed=seed, engine=engine,
+                         shape_class=POLICIES[version])
+    world.step(1)
+    world.close()
+    # a full collection also empties the interpreter's free lists, or the
+    # next world would reuse small objects a previous run left behind
+    # without tracemalloc seeing them
+    gc.collect()
+
+def run(version, engine, num_shapes, ticks=TICKS, seed=SEED, draw=True):
+    # the world is built under tracemalloc to see how big it is, but the
+    # ticks are timed without it, since tracing slows everything down
+    warm_up(version, engine, seed)
+    tracemalloc.start()
+    world = clique.World(num_shapes, seed=seed, engine=engine,
+                         shape_class=POLICIES[version])
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    clique.load_pygame()
+    surface = pygame.Surface(clique.size)
+    # (a profiler of the run's own, which keeps every tick)
+    profiler = Profiler(window=ticks, always=True)
+    game_profiler = clique.profiler
+    clique.profiler = profiler
+    try:
+        start = clock()
+        for i in range(ticks):
+            world.advance()
+            if draw:
+                profiler.start('draw')
+                surface.fill(clique.WHITE)
+                world.draw_shapes(surface)
+                world.player.render(surface)
+                profiler.stop('draw')
+            profiler.end_frame()
+        elapsed = clock() - start
+    finally:
+        clique.profiler = game_profiler
+    nearest = spread(world)
+    world.close()
+
+    return { 'version': version,
+             'engine': engine,
+             'shapes': num_shapes,
+             'ticks': ticks,
+             'seed': seed,
+             'draw': draw,
+             'ticks_per_sec': ticks / elapsed,
+             'move_ms': profiler.stats('move')[0],
+             'draw_ms': profiler.stats('draw')[0],
+             'age_ms': profiler.stats('age')[0],
+             'memory_kb': memory / 1024,
+             'nearest_px': nearest }
+
+def spread(world):
+    # the mean manhattan distance from each shape to its nearest neighbour
+    # (smaller for a more clustered crowd); a lone shape has none, and
+    # isn't counted
+    x, y = world.columns()[:2]
+    grid = SpatialGrid(clique.GRID_CELL_SIZE or fit_cell_size(x, y))
+    grid.rebuild((i, x[i], y[i], 0) for i in range(len(x)))
+    total = 0
+    counted = 0
+    for i in range(len(x)):
+        found = grid.nearest(x[i], y[i], exclude=i)
+        if found is not None:
+            total += found[3]
+            counted += 1
+    return total / max(counted, 1)
+
+def result_key(result):
+    return (result['version'], result['engine'], result['shapes'],
+            result['draw'])
+
+def print_results(results):
+    print('{:>7} {:>7} {:>7} {:>10} {:>9} {:>9} {:>9} {:>10} {:>8}'.format(
+        'version', 'engine', 'shapes', 'ticks/s', 'move ms', 'draw ms',
+        'age ms', 'memory kb', 'nearest'))
+    for r in results:
+        print('{:>7} {:>7} {:>7} {:>10.1f} {:>9.3f} {:>9.3f} {:>9.3f} '
+              '{:>10.0f} {:>8.1f}'.format(r['version'], r['engine'],
+                                          r['shapes'], r['ticks_per_sec'],
+                                          r['move_ms'], r['draw_ms'],
+                                          r['age_ms'], r['memory_kb'],
+                                          r.get('nearest_px', 0)))
+
+def regressions(results, baseline, tolerance=TOLERANCE):
+    # every result that is more than `tolerance` slower than the same run in
+    # the baseline, as (result, baseline result) pairs
+    before = dict((result_key(b), b) for b in baseline)
+    slower = []
+    for r in results:
+        b = before.get(result_key(r))
+        if (b is not None and
+            r['ticks_per_sec'] < b['ticks_per_sec'] * (1 - tolerance)):
+            slower.append((r, b))
+    return slower
+
+def parse_list(text):
+    return [item.strip() for item in text.split(',') if item.strip()]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--shapes', default='50,500',
+                        help='comma-separated world sizes (default 50,500)')
+    parser.add_argument('--ticks', type=int, default=TICKS)
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--versions', default='1,2,3',
+                        help='decision algorithms to measure (default 1,2,3)')
+    parser.add_argument('--engines', default='objects',
+                        help="any of 'objects', 'numpy' and 'parallel' "
+                             "(each version only runs on the engines in "
+                             "clique_policies.ENGINES)")
+    parser.add_argument('--no-draw', dest='draw', action='store_false',
+                        help='skip the draw phase')
+    parser.add_argument('--save', help='write the results to this json file')
+    parser.add_argument('--baseline',
+                        help='compare against results saved with --save')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args(argv)
+
+    results = []
+    for num_shapes in [int(n) for n in parse_list(args.shapes)]:
+        for version in [int(v) for v in parse_list(args.versions)]:
+            for engine in parse_list(args.engines):
+                if engine not in ENGINES[version]:
+                    continue
+                results.append(run(version, engine, num_shapes, args.ticks,
+                                   args.seed, args.draw))
+
+    print_results(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        slower = regressions(results, baseline, args.tolerance)
+        for r, b in slower:
+            print('REGRESSION: version {} ({}, {} shapes): {:.1f} ticks/s, '
+                  'was {:.1f}'.format(r['version'], r['engine'], r['shapes'],
+                                      r['ticks_per_sec'], b['ticks_per_sec']))
+        if slower:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
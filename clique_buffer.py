@@ -0,0 +1,142 @@
+"""
+Double-buffered world state for the array engines.
+
+Shapes decide where to go from everybody's *old* state, so the engines keep
+two copies of every per-shape array (position, type, shade, personal space,
+age, focus and last direction): the front buffer holds the world as of the
+last completed tick, and the next tick is written into the back buffer,
+which begin_tick() starts off as a copy of the front. Moves, aging and
+respawns all go into the back buffer, and swap() then makes it the front
+one. The front buffer never changes between swaps, so anything that reads it
+(a renderer, a recorder, a worker process) sees the whole world as of one
+tick, without copying it, even while the next tick is being computed. (A
+reader that holds on to the arrays of a front buffer has until the tick
+after next begins before they are overwritten; front() always gives the
+latest.)
+
+The player isn't in the arrays at all, since it can move at any time; the
+engines pass it around separately.
+
+A little scratch space rides along as well: the front buffer's points, sorted
+into cells for the neighbour search (see clique_numpy.bucket_points), so that
+they are only sorted once however many processes search them.
+
+With shared=True everything lives in one block of multiprocessing shared
+memory (Python 3.8 or later), which other processes can map by name.
+"""
+
+from __future__ import division, print_function
+import numpy as np
+
+# the arrays of each buffer
+FIELDS = ['x', 'y', 'kind', 'shade', 'side', 'space', 'age', 'focus',
+          'direction']
+# arrays there is only one of
+SCRATCH = ['order', 'cellkey']
+
+# row 0 is the header: which buffer is in front, then the bounds of the
+# stored buckets (see store_buckets)
+HEADER = 0
+FRONT = 0
+BOUNDS = 1
+HEADER_SIZE = 6
+# the first row of each buffer's arrays, and of the scratch arrays
+BUFFERS = [1, 1 + len(FIELDS)]
+ROW = dict((field, 1 + 2 * len(FIELDS) + i) for i, field in enumerate(SCRATCH))
+ROWS = 1 + 2 * len(FIELDS) + len(SCRATCH)
+
+
+class WorldBuffer(object):
+    def __init__(self, n, shared=False, name=None):
+        # n shapes. If name is given, attach to a shared buffer some other
+        # process made rather than making a new one.
+        self.n = n
+        shape = (ROWS, max(n, HEADER_SIZE))
+        self.memory = None
+        self.owner = name is None
+
+        if shared or name is not None:
+            from multiprocessing import shared_memory
+            if name is None:
+                self.memory = shared_memory.SharedMemory(
+                    create=True, size=8 * shape[0] * shape[1])
+            else:
+                # the creator is responsible for unlinking the block. (Before
+                # Python 3.13 attaching always registers it with the
+                # resource tracker, but child processes share their parent's
+                # tracker, which only counts each name once.)
+                try:
+                    self.memory = shared_memory.SharedMemory(name=name,
+                                                             track=False)
+                except TypeError:
+                    self.memory = shared_memory.SharedMemory(name=name)
+            self.block = np.ndarray(shape, dtype=np.int64,
+                                    buffer=self.memory.buf)
+            if self.owner:
+                self.block[:] = 0
+        else:
+            self.block = np.zeros(shape, dtype=np.int64)
+
+        self.header = self.block[HEADER]
+        self.buffers = [State(self.block, first, n) for first in BUFFERS]
+        for field in SCRATCH:
+            setattr(self, field, self.block[ROW[field]][:n])
+
+    @property
+    def name(self):
+        return self.memory.name if self.memory is not None else None
+
+    def front(self):
+        # the world as of the last completed tick
+        return self.buffers[int(self.header[FRONT])]
+
+    def back(self):
+        # the world being written for the next tick
+        return self.buffers[1 - int(self.header[FRONT])]
+
+    def begin_tick(self):
+        # start the back buffer off as a copy of the front
+        front = int(self.header[FRONT])
+        first = BUFFERS[front]
+        other = BUFFERS[1 - front]
+        self.block[other:other + len(FIELDS)] = \
+            self.block[first:first + len(FIELDS)]
+
+    def swap(self):
+        self.header[FRONT] = 1 - self.header[FRONT]
+
+    def store_buckets(self, buckets):
+        # keep what clique_numpy.bucket_points made of the front buffer's
+        # points
+        order, keys, bounds = buckets
+        self.order[:] = order
+        self.cellkey[:] = keys
+        self.header[BOUNDS:BOUNDS + len(bounds)] = bounds
+
+    def buckets(self):
+        # the buckets last stored, as bucket_points returned them
+        bounds = tuple(int(value) for value in
+                       self.header[BOUNDS:HEADER_SIZE])
+        return self.order, self.cellkey, bounds
+
+    def close(self):
+        # unmap the block; the process that made it also destroys it
+        if self.memory is not None:
+            self.header = self.block = self.buffers = None
+            for field in SCRATCH:
+                setattr(self, field, None)
+            self.memory.close()
+            if self.owner:
+                self.memory.unlink()
+            self.memory = None
+
+# end class WorldBuffer
+
+class State(object):
+    # one buffer of a WorldBuffer: an array of n values for each of FIELDS,
+    # under the attribute names clique_numpy.decide expects
+    def __init__(self, block, first, n):
+        for i, field in enumerate(FIELDS):
+            setattr(self, field, block[first + i][:n])
+
+# end class State
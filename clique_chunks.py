@@ -0,0 +1,123 @@
+"""
+Paging of far-away parts of the world out to disk.
+
+The plane is divided into square chunks. Only the chunks around the player
+are kept in memory and simulated; shapes in any other chunk are frozen,
+packed into fixed-size binary records and appended to that chunk's file in
+a ChunkStore. When the player comes back near a stored chunk, the whole
+chunk is read back in, and its shapes carry on from where they were, as old
+as they were, none the wiser.
+
+So however far the player travels, the population in memory is bounded by
+the active area around the player rather than the area travelled over.
+"""
+
+from __future__ import division, print_function
+import os, shutil, struct, tempfile
+
+CHUNK_SIZE = 2000
+ACTIVE_RADIUS = 1 # chunks around the player's own that stay in memory
+PAGE_INTERVAL = 32 # ticks between looking for shapes that wandered off
+
+# x, y, shape type index, side length, shade, age (followed by any extra
+# columns of the shapes' policy, see clique.Shape.EXTRA_COLUMNS)
+RECORD = struct.Struct('<iiBHBi')
+
+
+class ChunkStore(object):
+    # one file of packed records per stored chunk; by default the files go
+    # into a temporary directory, which is removed again by close(). record
+    # is the struct.Struct the records are packed with.
+    def __init__(self, directory=None, record=RECORD):
+        self.record = record
+        self.owned = directory is None
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix='clique-chunks-')
+        self.directory = directory
+        self.stored = set()
+
+    def path(self, chunk):
+        return os.path.join(self.directory, '%d_%d.chunk' % chunk)
+
+    def save(self, chunk, records):
+        # append records (tuples in RECORD's format) to a chunk
+        with open(self.path(chunk), 'ab') as f:
+            f.write(b''.join(self.record.pack(*record)
+                             for record in records))
+        self.stored.add(chunk)
+
+    def load(self, chunk):
+        # take all of a chunk's records out of the store
+        if chunk not in self.stored:
+            return []
+        path = self.path(chunk)
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.remove(path)
+        self.stored.discard(chunk)
+        return [self.record.unpack_from(data, offset)
+                for offset in range(0, len(data), self.record.size)]
+
+    def close(self):
+        if self.owned and self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory = None
+
+# end class ChunkStore
+
+class Pager(object):
+    def __init__(self, store, freeze, thaw, chunk_size=CHUNK_SIZE,
+                 radius=ACTIVE_RADIUS, interval=PAGE_INTERVAL):
+        # freeze(shape) must return a record for the store, and thaw(record)
+        # a new shape made from one
+        self.store = store
+        self.freeze = freeze
+        self.thaw = thaw
+        self.chunk_size = chunk_size
+        self.radius = radius
+        self.interval = interval
+        self.center = None # the player's chunk when the world was last paged
+        self.ticks = 0
+
+    def chunk_of(self, x, y):
+        return (int(x // self.chunk_size), int(y // self.chunk_size))
+
+    def due(self, x, y):
+        # should the world be paged, with the player at (x, y)? Yes if the
+        # player has moved to another chunk, and every so many ticks anyway,
+        # to catch shapes that have wandered out of the active chunks
+        self.ticks += 1
+        return (self.chunk_of(x, y) != self.center or
+                self.ticks >= self.interval)
+
+    def page(self, shapes, x, y):
+        # with the player at (x, y), freeze every shape outside the active
+        # chunks and thaw every stored chunk inside them. Returns the new
+        # list of shapes in memory: the ones that stayed, in the same order,
+        # then the ones thawed.
+        self.ticks = 0
+        self.center = cx, cy = self.chunk_of(x, y)
+        radius = self.radius
+
+        resident = []
+        frozen = {}
+        for shape in shapes:
+            chunk = self.chunk_of(shape.pos[0], shape.pos[1])
+            if (abs(chunk[0] - cx) <= radius and
+                abs(chunk[1] - cy) <= radius):
+                resident.append(shape)
+            else:
+                frozen.setdefault(chunk, []).append(self.freeze(shape))
+        for chunk, records in frozen.items():
+            self.store.save(chunk, records)
+
+        for chunk_x in range(cx - radius, cx + radius + 1):
+            for chunk_y in range(cy - radius, cy + radius + 1):
+                for record in self.store.load((chunk_x, chunk_y)):
+                    resident.append(self.thaw(record))
+        return resident
+
+    def close(self):
+        self.store.close()
+
+# end class Pager
@@ -0,0 +1,75 @@
+"""
+Dirty-rectangle drawing.
+
+Most frames only a few shapes change: the rest are drawn exactly where they
+were, with the same sprite. Rather than filling the whole screen, redrawing
+everything and flipping it all to the display, DirtyRects remembers which
+sprite went where last frame, clears only the spots that something has
+moved off (or changed on), draws the frame over that, and returns just the
+rectangles that changed, for pygame.display.update.
+
+Unless nothing at all changed, everything is still blitted (blits are cheap
+once sprites are cached, and a shape that didn't move may have been partly
+cleared by one that did), but the fill and the transfer to the display
+shrink to the parts of the screen that actually changed. When so much has
+changed that clearing it piecemeal would cost more than a full redraw, the
+whole frame is redrawn instead.
+"""
+
+from __future__ import division, print_function
+from clique_sprites import blit_all
+
+# clearing a rectangle costs about as much per row as filling a whole row of
+# the screen, so once the rectangles to clear add up to more rows than this
+# fraction of the screen's height, one full redraw is cheaper
+MAX_ROWS = 1.0
+
+
+class DirtyRects(object):
+    def __init__(self, background, max_rows=MAX_ROWS):
+        self.background = background
+        self.max_rows = max_rows
+        self.drawn = None # {(sprite, rect)} from the last frame
+        self.offset = None
+
+    def invalidate(self):
+        # the next frame gets drawn in full (e.g. after something else has
+        # been drawn over the screen)
+        self.drawn = None
+
+    def draw(self, surface, blits, offset):
+        # blits is a list of (sprite, position) pairs, drawn in order; offset
+        # is the camera offset, and everything has to be redrawn when it
+        # moves. Returns the rectangles that changed, or None if the whole
+        # surface was redrawn.
+        current = set()
+        for image, position in blits:
+            current.add((image, tuple(image.get_rect(topleft=position))))
+
+        full = (self.drawn is None or offset != self.offset)
+        if not full:
+            gone = self.drawn - current
+            new = current - self.drawn
+            rows = sum(rect[3] for image, rect in gone)
+            full = rows > self.max_rows * surface.get_height()
+
+        self.drawn = current
+        self.offset = offset
+
+        if full:
+            surface.fill(self.background)
+            blit_all(surface, blits)
+            return None
+
+        if not gone and not new:
+            # (e.g. drawing faster than the world steps)
+            return []
+
+        changed = [rect for image, rect in gone]
+        for rect in changed:
+            surface.fill(self.background, rect)
+        blit_all(surface, blits)
+        changed.extend(rect for image, rect in new)
+        return changed
+
+# end class DirtyRects
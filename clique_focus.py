@@ -0,0 +1,96 @@
+"""
+Temporal-coherence cache for the nearest-neighbour searches of Shape.move.
+
+Every shape moves at most one pixel per tick, so whoever was nearest to a
+shape last tick almost always still is. When a shape searches the spatial
+grid, FocusCache remembers what it found together with a margin: how far
+away everybody *else* was at the time. From then on, each tick can only
+have brought another shape 2 pixels closer (1 for each of the two shapes),
+and the player however far it has travelled since, so as long as the
+remembered focus is still strictly nearer than that shrinking bound, it must
+still be the nearest shape and no search is needed.
+
+Shapes that respawn jump anywhere at all, so they are remembered for a while
+and checked separately.
+"""
+
+from __future__ import division, print_function
+import collections
+
+# ticks a cached focus is trusted at most (and so how long respawns are kept)
+MAX_AGE = 16
+
+
+class FocusCache(object):
+    def __init__(self, grid, locate, max_age=MAX_AGE):
+        # locate(item) must return the item's current position in the same
+        # coordinates as the grid
+        self.grid = grid
+        self.locate = locate
+        self.max_age = max_age
+        self.tick = 0
+        self.travel = 0 # how far the player has moved, in total
+        self.entries = {} # item: (focus, tick, margin, travel)
+        self.spawns = collections.deque() # (tick, item, x, y), oldest first
+        self.searches = 0
+        self.reuses = 0
+
+    def begin_tick(self):
+        # call once before every move phase
+        self.tick += 1
+        spawns = self.spawns
+        while spawns and spawns[0][0] < self.tick - self.max_age:
+            spawns.popleft()
+
+    def clear(self):
+        # forget everything (e.g. when shapes have come and gone without
+        # respawning)
+        self.entries.clear()
+        self.spawns.clear()
+
+    def player_moved(self, distance):
+        self.travel += distance
+
+    def spawned(self, item, x, y):
+        # item has just (re)appeared at (x, y)
+        self.entries.pop(item, None)
+        self.spawns.append((self.tick, item, x, y))
+
+    def nearest(self, item, x, y):
+        # the same result as grid.nearest(x, y, exclude=item)
+        entry = self.entries.get(item)
+        if entry is not None:
+            focus, tick, margin, travel = entry
+            ticks = self.tick - tick
+            if ticks <= self.max_age:
+                fx, fy = self.locate(focus)
+                xdist = x - fx
+                ydist = y - fy
+                totaldist = abs(xdist) + abs(ydist)
+                bound = margin - ticks - max(ticks, self.travel - travel)
+                if (totaldist < bound and
+                    not self.respawned_near(focus, tick, x, y, totaldist)):
+                    self.reuses += 1
+                    return (focus, xdist, ydist, totaldist)
+
+        self.searches += 1
+        found = self.grid.nearest_with_margin(x, y, exclude=item)
+        if found is None:
+            self.entries.pop(item, None)
+            return None
+        self.entries[item] = (found[0], self.tick, found[4], self.travel)
+        return found[:4]
+
+    def respawned_near(self, focus, tick, x, y, totaldist):
+        # has the focus respawned since tick, or has anything respawned that
+        # could now be within totaldist of (x, y)?
+        for spawned, item, sx, sy in reversed(self.spawns):
+            if spawned < tick:
+                break
+            if item is focus:
+                return True
+            if abs(x - sx) + abs(y - sy) - (self.tick - spawned) <= totaldist:
+                return True
+        return False
+
+# end class FocusCache
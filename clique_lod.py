@@ -0,0 +1,80 @@
+"""
+Level-of-detail scheduling for the move phase.
+
+Nobody can see what shapes far away from the screen are up to, so there is
+no need to decide for every one of them on every tick. The world around the
+screen is divided into bands by distance from its edges; shapes in the first
+band (on or near the screen) move every tick as usual, and shapes further
+out only every few ticks, staggered so that the same number of them move on
+every tick. A shape that has been skipped makes up for it when its turn
+comes by moving as many steps as the ticks it missed, all in the direction
+it picks then.
+
+Shapes in the first band are found with a viewport query on the spatial
+grid, and the rest are visited a slice at a time (every period'th shape of
+the list), so the cost of a move phase grows with the area around the screen
+rather than with the size of the world.
+"""
+
+from __future__ import division, print_function
+
+# (how far from the edge of the screen the band reaches, in pixels; how
+# often shapes in it move, in ticks). The last band reaches everywhere.
+BANDS = [(200, 1), (1500, 4), (None, 16)]
+
+
+class Scheduler(object):
+    def __init__(self, bands=BANDS):
+        # shapes must have an `updated` attribute, which the scheduler uses
+        # to remember the last tick they moved on
+        assert bands[0][1] == 1 and bands[-1][0] is None
+        self.bands = bands
+        self.tick = 0
+
+    @property
+    def slack(self):
+        # over any run of ticks, a shape moves at most this many more steps
+        # than the number of ticks (the steps it saved up before the run)
+        return max(period for reach, period in self.bands) - 1
+
+    def band_of(self, x, y, viewport):
+        # index into bands for a shape at (x, y); viewport is the screen as
+        # (left, top, right, bottom) in world coordinates
+        left, top, right, bottom = viewport
+        distance = max(left - x, x - right, top - y, y - bottom, 0)
+        for band, (reach, period) in enumerate(self.bands):
+            if reach is None or distance <= reach:
+                return band
+
+    def due(self, shapes, grid, viewport, exclude=None):
+        # the shapes that move this tick, as (shape, steps) pairs. grid must
+        # hold the shapes at their current positions.
+        self.tick += 1
+        tick = self.tick
+        left, top, right, bottom = viewport
+        reach = self.bands[0][0]
+
+        moving = []
+        for shape in grid.query_rect(left - reach, top - reach,
+                                     right + reach, bottom + reach):
+            if (shape is not exclude and
+                self.band_of(shape.pos[0], shape.pos[1], viewport) == 0):
+                moving.append(self.take_turn(shape))
+
+        for band in range(1, len(self.bands)):
+            period = self.bands[band][1]
+            for shape in shapes[(-tick) % period::period]:
+                if (shape is not exclude and
+                    self.band_of(shape.pos[0], shape.pos[1], viewport)
+                    == band):
+                    moving.append(self.take_turn(shape))
+        return moving
+
+    def take_turn(self, shape):
+        # (a shape that keeps crossing between bands might miss more turns
+        # than the slowest band's period, but never makes up more than that)
+        steps = min(self.tick - shape.updated, self.slack + 1)
+        shape.updated = self.tick
+        return shape, max(steps, 1)
+
+# end class Scheduler
@@ -0,0 +1,395 @@
+"""
+Vectorized simulation engine for Version 3.
+
+Instead of one Python object per shape, the whole population is stored as a
+struct of NumPy arrays (positions, shape type indices, shades, personality
+and age), and each tick is computed for every shape at once: nearest
+neighbour, vote array, weighted choice of direction and the position update.
+The arrays live in a double-buffered WorldBuffer, and the Shape objects are
+kept alongside them, but they are only brought up to date (see
+ArrayEngine.sync) when somebody needs to draw them.
+
+Requires NumPy; the game only imports this module when ENGINE == 'numpy'.
+"""
+
+from __future__ import division, print_function
+import numpy as np
+from clique_buffer import WorldBuffer, FIELDS
+
+# these must agree with the direction constants in clique
+UP = 0
+DOWN = 1
+RIGHT = 2
+LEFT = 3
+STAY = 4
+
+XSTEP = np.array([0, 0, 1, -1, 0], dtype=np.int64)
+YSTEP = np.array([-1, 1, 0, 0, 0], dtype=np.int64)
+
+# the side of a cell in nearest_neighbours' grid, or None to fit it to the
+# points, so that each point shares its cell with about POINTS_PER_CELL
+# points on average (see fit_cell_size)
+CELL_SIZE = None
+POINTS_PER_CELL = 2
+# the most (query, point) pairs nearest_neighbours compares at once; a crowd
+# packed into a few cells is done in several passes instead of in one huge
+# array
+MAX_PAIRS = 1 << 18
+# queries that are still looking after this many rings of cells (strays far
+# from everyone else) compare themselves against every point instead
+MAX_RINGS = 8
+NOBODY = np.iinfo(np.int64).max
+
+
+def ring_offsets(r):
+    # (dx, dy) of every cell at chebyshev distance exactly r
+    if r == 0:
+        return np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64)
+    side = np.arange(-r, r + 1, dtype=np.int64)
+    inner = np.arange(-r + 1, r, dtype=np.int64)
+    dx = np.concatenate((side, side,
+                         np.full(inner.size, -r), np.full(inner.size, r)))
+    dy = np.concatenate((np.full(side.size, -r), np.full(side.size, r),
+                         inner, inner))
+    return dx, dy
+
+def fit_cell_size(px, py):
+    # a cell size for the points (px, py) (see CELL_SIZE). The first guess
+    # spreads them evenly over the box they take up; if they are bunched up
+    # (or a few strays make the box huge), the cells are shrunk by how much
+    # more crowded they turned out to be than that.
+    n = len(px)
+    area = (float(px.max() - px.min() + 1) *
+            float(py.max() - py.min() + 1))
+    size = max(1, int(round((area * POINTS_PER_CELL / n) ** 0.5)))
+    cx = px // size - px.min() // size
+    cy = py // size - py.min() // size
+    counts = np.unique(cx * (cy.max() + 1) + cy, return_counts=True)[1]
+    crowding = float((counts * counts).sum()) / (n * POINTS_PER_CELL)
+    return max(1, int(round(size / max(crowding, 1) ** 0.5)))
+
+def bucket_points(px, py, cell_size=CELL_SIZE):
+    # sort the points (px, py) into the cells of a grid, for search_buckets
+    # to look through: returns (order, keys, bounds), where order lists the
+    # points cell by cell (so each cell's points form one contiguous run of
+    # it), keys holds their cell keys in that order and bounds is
+    # (cell size, minx, maxx, miny, maxy), the occupied cells' bounds.
+    # There must be at least one point.
+    if cell_size is None:
+        cell_size = fit_cell_size(px, py)
+    pcx = px // cell_size
+    pcy = py // cell_size
+    minx, maxx = pcx.min(), pcx.max()
+    miny, maxy = pcy.min(), pcy.max()
+    keys = (pcx - minx) * (maxy - miny + 1) + (pcy - miny)
+    order = np.argsort(keys, kind='stable')
+    return order, keys[order], (cell_size, minx, maxx, miny, maxy)
+
+def nearest_neighbours(qx, qy, qself, px, py, cell_size=CELL_SIZE):
+    # for every query point (qx[i], qy[i]), find the nearest of the points
+    # (px, py) by manhattan distance, ignoring point qself[i] (-1 ignores
+    # nothing). Ties go to the lowest point index, as in a linear scan.
+    # Returns (index, xdist, ydist, totaldist) arrays, with xdist = qx - px
+    # as in Shape.move; index is -1 where there was nothing to find.
+    if len(qx) == 0 or len(px) == 0:
+        return _unpack(np.full(len(qx), NOBODY, dtype=np.int64),
+                       qx, qy, px, py)
+    return search_buckets(qx, qy, qself, px, py,
+                          bucket_points(px, py, cell_size))
+
+def search_buckets(qx, qy, qself, px, py, buckets):
+    # nearest_neighbours, with the points already sorted into cells by
+    # bucket_points (so that the same points can be searched many times,
+    # e.g. by several processes, but only sorted once)
+    order, skeys, bounds = buckets
+    cell_size, minx, maxx, miny, maxy = bounds
+    height = maxy - miny + 1
+    nq = len(qx)
+    npts = len(px)
+    best = np.full(nq, NOBODY, dtype=np.int64)
+    if nq == 0:
+        return _unpack(best, qx, qy, px, py)
+
+    qcx = qx // cell_size
+    qcy = qy // cell_size
+    # beyond this ring there is nothing left for a query to find
+    last = np.maximum(np.maximum(qcx - minx, maxx - qcx),
+                      np.maximum(qcy - miny, maxy - qcy))
+
+    active = np.arange(nq)
+    r = 0
+    while active.size and r <= MAX_RINGS:
+        dx, dy = ring_offsets(r)
+        ccx = (qcx[active][:, None] + dx).ravel()
+        ccy = (qcy[active][:, None] + dy).ravel()
+        owner = np.repeat(active, dx.size)
+
+        inside = (ccx >= minx) & (ccx <= maxx) & (ccy >= miny) & (ccy <= maxy)
+        ccx = ccx[inside]
+        ccy = ccy[inside]
+        owner = owner[inside]
+
+        ckeys = (ccx - minx) * height + (ccy - miny)
+        start = np.searchsorted(skeys, ckeys, 'left')
+        count = np.searchsorted(skeys, ckeys, 'right') - start
+        occupied = count > 0
+        start = start[occupied]
+        count = count[occupied]
+        owner = owner[occupied]
+
+        # compare no more than MAX_PAIRS pairs at a time (but always at
+        # least one whole cell)
+        ends = np.cumsum(count)
+        lo = 0
+        while lo < count.size:
+            hi = np.searchsorted(ends, ends[lo] - count[lo] + MAX_PAIRS,
+                                 'right')
+            hi = max(hi, lo + 1)
+            _closest(best, owner[lo:hi], start[lo:hi], count[lo:hi],
+                     order, qself, qx, qy, px, py)
+            lo = hi
+
+        found = best[active]
+        done = ((found != NOBODY) & (found // npts <= r * cell_size)
+                | (last[active] <= r))
+        active = active[~done]
+        r += 1
+
+    batch = max(1, MAX_PAIRS // npts)
+    for lo in range(0, active.size, batch):
+        q = active[lo:lo + batch]
+        codes = ((np.abs(qx[q][:, None] - px) + np.abs(qy[q][:, None] - py))
+                 * npts + np.arange(npts))
+        rows = qself[q] >= 0
+        codes[rows, qself[q][rows]] = NOBODY
+        best[q] = np.minimum(best[q], codes.min(axis=1))
+
+    return _unpack(best, qx, qy, px, py)
+
+def _closest(best, owner, start, count, order, qself, qx, qy, px, py):
+    # expand every (query, occupied cell) pair into one row per point in the
+    # cell, and keep each query's closest in best (as distance * number of
+    # points + index, so that ties go to the lowest index)
+    total = count.sum()
+    first = np.cumsum(count) - count
+    q = np.repeat(owner, count)
+    cand = order[np.repeat(start - first, count) + np.arange(total)]
+
+    keep = cand != qself[q]
+    q = q[keep]
+    cand = cand[keep]
+    dist = np.abs(qx[q] - px[cand]) + np.abs(qy[q] - py[cand])
+    np.minimum.at(best, q, dist * len(px) + cand)
+
+def _unpack(best, qx, qy, px, py):
+    if len(px) == 0:
+        nobody = np.full(len(best), -1, dtype=np.int64)
+        zeros = np.zeros(len(best), dtype=np.int64)
+        return nobody, zeros, zeros, zeros
+    index = np.where(best == NOBODY, -1, best % len(px))
+    safe = np.maximum(index, 0)
+    xdist = np.where(index < 0, 0, qx - px[safe])
+    ydist = np.where(index < 0, 0, qy - py[safe])
+    return index, xdist, ydist, np.abs(xdist) + np.abs(ydist)
+
+def pair_codes(xdist, ydist):
+    # clique_rules.pair_of for every neighbour at once
+    alongx = np.abs(xdist) > np.abs(ydist)
+    codes = np.where(alongx,
+                     np.where(xdist > 0, 0, 1),
+                     np.where(ydist > 0, 2, 3))
+    return np.where((xdist == 0) & (ydist == 0), 4, codes)
+
+def rule_arrays(rules):
+    # a clique_rules.RuleTable as arrays: (buckets, countdowns, totals),
+    # with every vote array of the table already turned into countdowns
+    votes = np.array(rules.votes, dtype=np.int64)
+    return (np.array(rules.buckets, dtype=np.int64),) + countdowns(votes)
+
+def countdowns(votes):
+    # best_dir numbers the votes from the top, total down to 1, and picks
+    # the first direction whose last number is <= its position. Returns
+    # those last numbers and the totals; directions without votes can never
+    # be picked, so their number is made too big to ever be <= position.
+    total = votes.sum(axis=-1)
+    last = total[..., None] - np.cumsum(votes, axis=-1) + 1
+    return np.where(votes > 0, last, total[..., None] + 2), total
+
+def sample_directions(countdown, total, uniforms):
+    # the same choice as best_dir for the same random numbers, for every
+    # shape at once and in constant time per shape
+    position = uniforms * total + 1
+    return (countdown <= position[:, None]).argmax(axis=1)
+
+def rule_index(state, rows, xdist, ydist, totaldist, kinds, shades, buckets):
+    # where the vote array of Shape.where_to for each shape in rows is in the
+    # rule table, given that their nearest neighbours are of these kinds and
+    # shades (see decide)
+    kind = state.kind[rows]
+    bucket = buckets[kind, np.abs(state.shade[rows] - shades)]
+    invaded = (totaldist < state.space[rows]).astype(np.int64)
+    return (kind, kinds, bucket, invaded, pair_codes(xdist, ydist))
+
+def decide(state, rows, player, uniforms, tables, buckets):
+    # one tick's worth of Shape.move for the shapes in rows: returns their
+    # directions and the index of the point each one focused on.
+    # state holds every shape's arrays (x, y, kind, shade, space), whose
+    # points bucket_points sorted into buckets, and player is the player's
+    # (x, y, kind, shade); it counts as the point after the last shape.
+    # uniforms holds one random number in [0, 1) per row, and tables is the
+    # rule table (see rule_arrays).
+    qx = state.x[rows]
+    qy = state.y[rows]
+    index, xdist, ydist, totaldist = search_buckets(
+        qx, qy, rows, state.x, state.y, buckets)
+
+    # the player loses ties, as the last point
+    px = qx - player[0]
+    py = qy - player[1]
+    pdist = np.abs(px) + np.abs(py)
+    seen = (index < 0) | (pdist < totaldist)
+    nearest = np.maximum(index, 0)
+    kinds = np.where(seen, player[2], state.kind[nearest])
+    shades = np.where(seen, player[3], state.shade[nearest])
+    index = np.where(seen, len(state.x), index)
+    xdist = np.where(seen, px, xdist)
+    ydist = np.where(seen, py, ydist)
+    totaldist = np.where(seen, pdist, totaldist)
+
+    shade_buckets, countdown, total = tables
+    rule = rule_index(state, rows, xdist, ydist, totaldist, kinds, shades,
+                      shade_buckets)
+    return sample_directions(countdown[rule], total[rule], uniforms), index
+
+
+class ArrayEngine(object):
+    def __init__(self, shapes, player, shape_types, max_age, offset, rules,
+                 seed=None, cell_size=CELL_SIZE, shared=False):
+        # shapes: the population (not including the player); shapes that die
+        #         of old age are recycled in place with Shape.respawn
+        # offset: the game's OFFSET list, read every tick to find the player
+        # rules:  the game's clique_rules.RuleTable
+        # shared: keep the world state in shared memory (see WorldBuffer)
+        self.shapes = [shape for shape in shapes if shape is not player]
+        self.player = player
+        self.shape_types = shape_types
+        self.max_age = max_age
+        self.offset = offset
+        self.rules = rules
+        self.tables = rule_arrays(rules)
+        self.cell_size = cell_size
+        self.rng = np.random.default_rng(seed)
+
+        self.player_kind = shape_types.index(player.shape_type)
+        self.buffer = WorldBuffer(len(self.shapes), shared)
+        # (the shapes are loaded into the front buffer)
+        self.bind()
+        for i, shape in enumerate(self.shapes):
+            self.load(i, shape, self.buffer.front())
+
+    def bind(self):
+        # x, y, kind and the rest always refer to the front buffer's arrays
+        front = self.buffer.front()
+        for field in FIELDS:
+            setattr(self, field, getattr(front, field))
+
+    def load(self, i, shape, state):
+        # put a shape into slot i of one buffer
+        self.shapes[i] = shape
+        state.x[i] = shape.pos[0]
+        state.y[i] = shape.pos[1]
+        state.kind[i] = self.shape_types.index(shape.shape_type)
+        state.shade[i] = shape.shade
+        state.side[i] = shape.side_length
+        state.space[i] = shape.persona.personal_space
+        state.age[i] = shape.age
+        state.focus[i] = -1
+
+    def player_point(self):
+        # the player as decide sees it: (x, y, kind, shade), in world
+        # coordinates (its pos is in screen coordinates)
+        return (self.player.pos[0] - self.offset[0],
+                self.player.pos[1] - self.offset[1],
+                self.player_kind, self.player.shade)
+
+    def tick(self):
+        self.move()
+        self.age_shapes()
+
+    def move(self):
+        # the decisions go into the back buffer; it comes to the front at
+        # the end of age_shapes
+        self.buffer.begin_tick()
+        n = len(self.shapes)
+        if n == 0:
+            return
+        front = self.buffer.front()
+        back = self.buffer.back()
+        back.direction[:], back.focus[:] = decide(
+            front, np.arange(n), self.player_point(), self.rng.random(n),
+            self.tables, bucket_points(front.x, front.y, self.cell_size))
+        self.step()
+
+    def step(self):
+        # every decision was made from the front buffer, so the new
+        # positions all go into the back buffer
+        front = self.buffer.front()
+        back = self.buffer.back()
+        back.x[:] = front.x + XSTEP[back.direction]
+        back.y[:] = front.y + YSTEP[back.direction]
+
+    def close(self):
+        self.buffer.close()
+
+    def age_shapes(self, profiler=None):
+        # shapes are aged and respawned in the back buffer, which then comes
+        # to the front. profiler, if given, times the respawns (see
+        # clique_profile).
+        back = self.buffer.back()
+        back.age += 1
+        if profiler is not None: profiler.start('respawn')
+        for i in np.nonzero(back.age > self.max_age)[0]:
+            shape = self.shapes[i]
+            shape.respawn()
+            self.load(i, shape, back)
+        if profiler is not None: profiler.stop('respawn')
+        self.buffer.swap()
+        self.bind()
+
+    def visible(self, size):
+        # indices of every shape that would be drawn on a screen of this size
+        side = self.side
+        xpos = self.x + self.offset[0]
+        ypos = self.y + self.offset[1]
+        offscreen = ((xpos > size[0] + side) | (xpos < -side) |
+                     (ypos > size[1] + side) | (ypos < -side))
+        return np.nonzero(~offscreen)[0]
+
+    def sync(self, indices):
+        # copy array state back into the Shape objects at these indices, and
+        # return those shapes
+        synced = []
+        n = len(self.shapes)
+        for i in indices:
+            shape = self.shapes[i]
+            shape.nextpos[0] = int(self.x[i])
+            shape.nextpos[1] = int(self.y[i])
+            shape.update_position()
+            shape.age = int(self.age[i])
+            focus = self.focus[i]
+            if focus < 0:
+                shape.focus = None
+            elif focus == n:
+                shape.focus = self.player
+            else:
+                shape.focus = self.shapes[focus]
+            synced.append(shape)
+        return synced
+
+    def columns(self):
+        # see World.columns
+        return (self.x.tolist(), self.y.tolist(), self.focus.tolist(),
+                self.kind.tolist(), self.side.tolist(), self.shade.tolist(),
+                self.age.tolist())
+
+# end class ArrayEngine
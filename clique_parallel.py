@@ -0,0 +1,101 @@
+"""
+Multi-process move phase for the array engine.
+
+During the move phase every shape only reads the old positions of the others
+and decides its own next step, so the population can be split up and decided
+on by several processes at once. ParallelEngine keeps its world state in a
+shared-memory WorldBuffer that every worker maps when it starts. Each tick
+the parent sorts the points into cells for the neighbour search once, into
+the buffer, and draws every shape's random number; then it groups the shapes
+into runs of neighbouring spatial tiles of roughly equal size and hands one
+run to each task, along with where the player is. Workers only search: they
+read the front buffer and its cells in place, write their shapes' directions
+and foci straight into the back buffer, and the results are applied before
+anything is drawn. Since no
+shape's decision depends on which task it was in, a seeded world does just
+what it would on ArrayEngine, however many workers there are.
+
+Requires NumPy and Python 3.8 or later (for multiprocessing.shared_memory);
+the game only imports this module when ENGINE == 'parallel'.
+"""
+
+from __future__ import division, print_function
+import multiprocessing
+import numpy as np
+from clique_buffer import WorldBuffer
+from clique_numpy import (ArrayEngine, decide, rule_arrays, bucket_points,
+                          CELL_SIZE)
+
+TILE_SIZE = 400
+TASKS_PER_WORKER = 4 # more, smaller tasks even out uneven tiles
+
+# each worker process attaches to the buffer once, when it starts
+_worker = {}
+
+def _init_worker(name, n, rules):
+    _worker['buffer'] = WorldBuffer(n, name=name)
+    _worker['tables'] = rule_arrays(rules)
+
+def _decide_rows(task):
+    rows, uniforms, player = task
+    buffer = _worker['buffer']
+    # (which buffer is in front changes every tick)
+    back = buffer.back()
+    back.direction[rows], back.focus[rows] = decide(
+        buffer.front(), rows, player, uniforms, _worker['tables'],
+        buffer.buckets())
+
+
+class ParallelEngine(ArrayEngine):
+    def __init__(self, shapes, player, shape_types, max_age, offset, rules,
+                 seed=None, cell_size=CELL_SIZE, workers=None,
+                 tile_size=TILE_SIZE):
+        ArrayEngine.__init__(self, shapes, player, shape_types, max_age,
+                             offset, rules, seed, cell_size, shared=True)
+        self.tile_size = tile_size
+        self.workers = workers or multiprocessing.cpu_count()
+        self.pool = multiprocessing.Pool(self.workers, _init_worker,
+                                         (self.buffer.name, len(self.shapes),
+                                          rules))
+
+    def tiles(self):
+        # split the shapes into about workers * TASKS_PER_WORKER lists of
+        # indices, each made up of whole, neighbouring tiles
+        tx = self.x // self.tile_size
+        ty = self.y // self.tile_size
+        order = np.lexsort((ty, tx))
+        tile = (tx[order], ty[order])
+        starts = np.flatnonzero((np.diff(tile[0]) != 0) |
+                                (np.diff(tile[1]) != 0)) + 1
+        if starts.size == 0:
+            return [order]
+        tasks = self.workers * TASKS_PER_WORKER
+        targets = np.linspace(0, len(order), tasks + 1)[1:-1]
+        nearest = np.clip(np.searchsorted(starts, targets), 0, starts.size - 1)
+        return [rows for rows in np.split(order, np.unique(starts[nearest]))
+                if rows.size]
+
+    def move(self):
+        self.buffer.begin_tick()
+        n = len(self.shapes)
+        if n == 0:
+            return
+
+        # (the same random numbers, in the same order, as ArrayEngine.move)
+        front = self.buffer.front()
+        self.buffer.store_buckets(bucket_points(front.x, front.y,
+                                                self.cell_size))
+        uniforms = self.rng.random(n)
+        player = self.player_point()
+        self.pool.map(_decide_rows, [(rows, uniforms[rows], player)
+                                     for rows in self.tiles()])
+        self.step()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        ArrayEngine.close(self)
+
+# end class ParallelEngine
@@ -0,0 +1,241 @@
+"""
+Decision policies: the rules that make shapes move, one per version of the
+game, as plugins for the shared simulation in clique.
+
+A policy is a subclass of clique.Shape. Everything else (the world, the
+spatial grid and focus cache, drawing, recording and the benchmarks) is the
+same whichever policy is running; a policy only replaces the parts of Shape
+that decide:
+
+    where_to(nearest, location)  the direction to take, given the nearest
+                                 shape and (xdist, ydist, totaldist) to it,
+                                 as found by Shape.move's neighbour search
+    move(steps)                  the whole decision, for policies that look
+                                 at more than the nearest shape
+    respawn()                    for policies with state of their own
+
+Version 3 is clique.Shape itself, and Versions 1 and 2 are ported from
+clique_main_1.py and clique_main_2.py. Run one with
+World(shape_class=POLICIES[version]).
+"""
+
+from __future__ import division, print_function
+import math
+import clique
+from clique import (UP, DOWN, RIGHT, LEFT, STAY, RAND,
+                    SHAPE_MEAN, SHAPE_DEV, Shape)
+
+# Version 1 constants
+LINE_OF_SIGHT = 500
+# if the square around a shape's line of sight takes in at least this much of
+# the area the crowd is spread over, it is quicker to check every shape than
+# to visit every cell in range (see Version1Shape.in_sight); and so it is for
+# a world of fewer than SCAN_SHAPES shapes, however spread out
+SCAN_COVERAGE = 0.3
+SCAN_SHAPES = 100
+# Version 2 constants
+RGB_TOLERANCE = 150
+
+
+class Version1Personality(object):
+    # every shape has one of its own; it is only drawn at random if it isn't
+    # given (e.g. by Version1Shape.restore)
+    __slots__ = ('rgb_tolerance', 'personal_space')
+
+    def __init__(self, shape_type, rgb_tolerance=None, personal_space=None):
+        if rgb_tolerance is None:
+            rgb_tolerance = int(RAND.gauss(50, 10))
+            personal_space = int(RAND.gauss(SHAPE_MEAN[shape_type] * 2,
+                                            SHAPE_DEV[shape_type] / 2))
+        self.rgb_tolerance = rgb_tolerance
+        self.personal_space = personal_space
+
+# end class Version1Personality
+
+class Version1Shape(Shape):
+    # Shape.move from clique_main_1.py: every shape within LINE_OF_SIGHT gets
+    # a say, and shapes only change direction a quarter of the time. Shapes
+    # are gray now, so all three of their color channels are the same shade.
+    __slots__ = ('direction',)
+
+    ENGINES = ['objects']
+    # the personality and inertia have to survive snapshots and paging
+    EXTRA_COLUMNS = [('rgb_tolerance', 'i'), ('personal_space', 'i'),
+                     ('direction', 'B')]
+
+    def __init__(self, position, shape_type, side_length, shade, persona, age):
+        # (persona is only kept if it's a Version1Personality already)
+        if not isinstance(persona, Version1Personality):
+            persona = Version1Personality(shape_type)
+        Shape.__init__(self, position, shape_type, side_length, shade,
+                       persona, age)
+        self.direction = STAY
+
+    def extra_values(self):
+        return (self.persona.rgb_tolerance, self.persona.personal_space,
+                self.direction)
+
+    @classmethod
+    def restore(cls, position, shape_type, side_length, shade, age, extra):
+        rgb_tolerance, personal_space, direction = extra
+        persona = Version1Personality(shape_type, rgb_tolerance,
+                                      personal_space)
+        shape = cls(position, shape_type, side_length, shade, persona, age)
+        shape.direction = direction
+        return shape
+
+    def respawn(self):
+        Shape.respawn(self)
+        self.persona = Version1Personality(self.shape_type)
+        self.direction = STAY
+
+    def move(self, steps=1):
+        if RAND.random() < .25: # shape is changing direction
+
+            # 0 for UP, 1 for DOWN, 2 for RIGHT, 3 for LEFT, 4 for STAY
+            votes = [0,0,0,0,0]
+
+            self_type = self.shape_type
+            shade = self.shade
+            rgb_tolerance = self.persona.rgb_tolerance
+            space_tolerance = self.persona.personal_space
+            # (a shape with no personal space can't have it invaded)
+            space_squared = max(space_tolerance, 0) ** 2
+
+            for shape, xdist, ydist, squared in self.in_sight():
+                approach = closer_v1(xdist, ydist)
+                avoid = further_v1(xdist, ydist)
+
+                if squared < space_squared:
+                    votes[avoid] += (space_tolerance -
+                                     int(math.sqrt(squared)))
+
+                if self_type != shape.shape_type:
+                    votes[avoid] += 3
+
+                # one vote for each of the red, green and blue channels
+                # that are close enough, and they're all the same shade
+                if abs(shape.shade - shade) <= rgb_tolerance:
+                    votes[approach] += 3
+
+            direction = bestvote(votes)
+
+        else: # shape is not changing direction
+            direction = self.direction
+
+        if   direction == UP:    self.nextpos[1] -= steps
+        elif direction == DOWN:  self.nextpos[1] += steps
+        elif direction == RIGHT: self.nextpos[0] += steps
+        elif direction == LEFT:  self.nextpos[0] -= steps
+
+        self.direction = direction
+
+    def in_sight(self):
+        # every shape less than LINE_OF_SIGHT away (this one included), as
+        # (shape, xdist, ydist, squared distance), in the order of the list
+        # of shapes. The grid only looks at the cells in range, so a move
+        # costs about as much as the crowd within sight, not the whole world;
+        # but a small crowd, or one that is mostly within sight anyway (on
+        # one screen, say), is quicker to scan than to visit cell by cell.
+        xpos = self.pos[0]
+        ypos = self.pos[1]
+        if clique.USE_GRID and len(clique.shapes) >= SCAN_SHAPES:
+            grid = clique.grid
+            if grid.coverage(xpos - LINE_OF_SIGHT, ypos - LINE_OF_SIGHT,
+                             xpos + LINE_OF_SIGHT, ypos + LINE_OF_SIGHT) \
+                    < SCAN_COVERAGE:
+                return grid.query_radius(xpos, ypos, LINE_OF_SIGHT)
+
+        limit = LINE_OF_SIGHT * LINE_OF_SIGHT
+        seen = []
+        for shape in clique.shapes:
+            x, y = clique.grid_position(shape)
+            xdist = xpos - x
+            ydist = ypos - y
+            squared = xdist * xdist + ydist * ydist
+            if squared < limit:
+                seen.append((shape, xdist, ydist, squared))
+        return seen
+
+# end class Version1Shape
+
+def bestvote(votes):
+    maxpos = 0
+    maxval = votes[0]
+    for i in range(1, len(votes)):
+        if votes[i] >= maxval:
+            maxpos = i
+            maxval = votes[i]
+    return maxpos
+
+def closer_v1(xdist, ydist):
+    if xdist == ydist == 0:
+        return STAY
+    if RAND.random() < 0.5:
+        if xdist > 0:
+            return LEFT
+        else:
+            return RIGHT
+    else:
+        if ydist > 0:
+            return UP
+        else:
+            return DOWN
+
+def further_v1(xdist, ydist):
+    if RAND.random() < 0.5:
+        if xdist > 0:
+            return RIGHT
+        else:
+            return LEFT
+    else:
+        if ydist > 0:
+            return DOWN
+        else:
+            return UP
+
+class Version2Shape(Shape):
+    # Shape.where_to from clique_main_2.py: a strict order of preferences
+    # about the nearest shape only (finding it is shared with Version 3)
+    __slots__ = ()
+
+    ENGINES = ['objects']
+
+    def where_to(self, nearest, location):
+        vote = STAY
+
+        xdist     = location[0]
+        ydist     = location[1]
+        totaldist = location[2]
+
+        approach = clique.closer(xdist, ydist)
+        avoid = clique.further(xdist, ydist)
+
+        if totaldist < self.persona.personal_space:
+            vote = avoid
+        else:
+            if self.shape_type == nearest.shape_type:
+                vote = approach
+            elif abs(clique.SHAPE_TYPES.index(self.shape_type) -
+                     clique.SHAPE_TYPES.index(nearest.shape_type)) > 2:
+                vote = avoid
+
+            # shapes are gray now, so every channel is the same shade
+            red_tolerant   = ( abs(self.shade - nearest.shade)
+                               <= RGB_TOLERANCE)
+            green_tolerant = red_tolerant
+            blue_tolerant  = red_tolerant
+
+            if red_tolerant and green_tolerant and blue_tolerant:
+                vote = approach
+            elif not red_tolerant and not green_tolerant and not blue_tolerant:
+                vote = avoid
+
+        return vote
+
+# end class Version2Shape
+
+POLICIES = {1: Version1Shape, 2: Version2Shape, 3: Shape}
+# the engines that can run each policy (see Shape.ENGINES)
+ENGINES = dict((version, policy.ENGINES)
+               for version, policy in POLICIES.items())
@@ -0,0 +1,147 @@
+"""
+Per-phase profiling for the main loop (the successor to Version 2a's
+profiler, but built in and cheap enough to leave in place).
+
+The game wraps each phase of a frame in start()/stop() calls and calls
+end_frame() once the frame is on screen. While the profiler is disabled those
+calls return straight away; once enabled, the last WINDOW frames of every
+phase are kept, so the overlay can show averages, 95th percentiles and a
+histogram of frame costs, and each frame can be appended to a CSV file.
+"""
+
+from __future__ import division, print_function
+import collections, time
+
+clock = getattr(time, 'perf_counter', time.time)
+
+PHASES = ['events', 'move', 'draw', 'age', 'respawn', 'flip']
+WINDOW = 300 # frames of history kept per phase
+# upper edges of the histogram buckets, in milliseconds (the last bucket
+# holds everything slower)
+HISTOGRAM_EDGES = [0.5, 1, 2, 4, 8, 16, 32]
+CSV_PATH = 'clique_profile.csv'
+
+
+class Profiler(object):
+    def __init__(self, phases=PHASES, window=WINDOW, always=False):
+        # always: keep timing even with no overlay or CSV file to show it
+        # (e.g. for clique_bench, which reads the history itself)
+        self.phases = list(phases)
+        self.always = always
+        self.enabled = always
+        self.overlay = False
+        self.csv = None
+        self.font = None
+        self.frames = 0
+        self.history = dict((phase, collections.deque(maxlen=window))
+                            for phase in self.phases)
+        self.frame = dict.fromkeys(self.phases, 0.0)
+        self.started = {}
+
+    def start(self, phase):
+        if self.enabled:
+            self.started[phase] = clock()
+
+    def stop(self, phase):
+        # a phase may run several times in one frame (e.g. respawn), so its
+        # times are added up until the frame ends
+        # (and it may have been switched on half way through a phase)
+        if self.enabled:
+            started = self.started.pop(phase, None)
+            if started is not None:
+                self.frame[phase] += clock() - started
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+        self.frames += 1
+        for phase in self.phases:
+            self.history[phase].append(self.frame[phase] * 1000)
+            self.frame[phase] = 0.0
+        if self.csv is not None:
+            self.csv.write(','.join(
+                [str(self.frames)] +
+                ['%.4f' % self.history[phase][-1] for phase in self.phases])
+                + '\n')
+
+    def stats(self, phase):
+        # (mean, 95th percentile, max) in milliseconds over the window
+        samples = sorted(self.history[phase])
+        if not samples:
+            return (0.0, 0.0, 0.0)
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        return (sum(samples) / len(samples), p95, samples[-1])
+
+    def histogram(self, phase, edges=HISTOGRAM_EDGES):
+        counts = [0] * (len(edges) + 1)
+        for sample in self.history[phase]:
+            bucket = 0
+            while bucket < len(edges) and sample > edges[bucket]:
+                bucket += 1
+            counts[bucket] += 1
+        return counts
+
+    def report(self):
+        lines = []
+        for phase in self.phases:
+            mean, p95, most = self.stats(phase)
+            lines.append('%-8s avg %6.2f  p95 %6.2f  max %6.2f ms' %
+                         (phase, mean, p95, most))
+        return lines
+
+    def toggle_overlay(self):
+        self.overlay = not self.overlay
+        self.update_enabled()
+
+    def toggle_csv(self, path=CSV_PATH):
+        if self.csv is None:
+            self.csv = open(path, 'w')
+            self.csv.write(','.join(['frame'] + self.phases) + '\n')
+        else:
+            self.csv.close()
+            self.csv = None
+        self.update_enabled()
+
+    def close(self):
+        # stop logging to the CSV file, if it's open, so nothing buffered
+        # is lost, and let go of the font, which doesn't survive
+        # pygame.quit() (the next game would crash drawing with it)
+        if self.csv is not None:
+            self.toggle_csv()
+        self.font = None
+
+    def update_enabled(self):
+        # only pay for timing while somebody is looking at the results
+        self.enabled = self.always or self.overlay or self.csv is not None
+        if not self.enabled:
+            self.started.clear()
+            for phase in self.phases:
+                self.frame[phase] = 0.0
+
+    def draw(self, surface, color=(255, 0, 0)):
+        if not self.overlay:
+            return
+        import pygame
+        if self.font is None:
+            pygame.font.init()
+            self.font = pygame.font.Font(None, 20)
+
+        lineheight = self.font.get_linesize()
+        top = 5
+        for phase, line in zip(self.phases, self.report()):
+            text = self.font.render(line, True, color)
+            surface.blit(text, (5, top))
+
+            # one bar per histogram bucket, scaled to the busiest bucket
+            counts = self.histogram(phase)
+            tallest = max(counts) or 1
+            left = 10 + text.get_width()
+            for count in counts:
+                height = int((lineheight - 4) * count / tallest)
+                pygame.draw.rect(surface, color,
+                                 (left, top + lineheight - 2 - height,
+                                  6, height))
+                left += 8
+            top += lineheight
+
+# end class Profiler
@@ -0,0 +1,220 @@
+"""
+Recording simulation runs to a compact binary file, and replaying them.
+
+A recording is a header followed by one frame per tick, then an index of
+where each frame starts. Every frame holds the player's position and each
+shape's position and focus, stored column by column. Most frames are delta
+frames: shapes move a pixel or so per tick, so positions are stored as one
+signed byte per axis per shape, and only the foci that changed are listed.
+Shapes that respawned since the last frame are listed with their new
+position and traits. Every KEYFRAME_INTERVAL ticks (and whenever a shape
+moved too far for a byte), a keyframe stores everything in full instead, so
+a replay can jump anywhere without reading the whole run.
+
+Replay memory-maps the file and rebuilds any tick from the keyframe before
+it, so runs can be scrubbed through without re-running the simulation.
+
+    header    '<4sHHIIii' magic, version, 0, shapes, keyframe interval,
+                          screen width and height
+    frame     '<BIiiII'   KEY or DELTA, tick, player x, player y,
+                          respawns, focus changes
+      KEY     x, y (int32), kind (uint8), side (uint16), shade (uint8),
+              focus (int32) columns
+      DELTA   dx, dy (int8) columns; respawns '<IBHBii' (shape, kind, side,
+              shade, x, y); changed foci: shapes (uint32), foci (int32)
+    index     frame offsets (uint64), then '<QI4s' (index offset, frames,
+              end magic)
+
+A focus is the index of a shape, the number of shapes for the player, or -1
+for nobody. The number of shapes must stay the same for the whole run.
+"""
+
+from __future__ import division, print_function
+import array, bisect, mmap, struct, sys
+
+MAGIC = b'CLQR'
+END_MAGIC = b'CLQE'
+VERSION = 2
+KEYFRAME_INTERVAL = 100
+
+HEADER = struct.Struct('<4sHHIIii')
+FRAME = struct.Struct('<BIiiII')
+RESPAWN = struct.Struct('<IBHBii')
+TRAILER = struct.Struct('<QI4s')
+KIND = struct.Struct('<B') # the start of FRAME
+KEY = 0
+DELTA = 1
+
+# the byte order the columns are stored in
+BIG_ENDIAN = sys.byteorder == 'big'
+# (Python 2's arrays only have tostring and fromstring, and no 'Q'
+# typecode, so the index of frame offsets is packed with struct instead)
+tobytes = getattr(array.array, 'tobytes', None) or array.array.tostring
+frombytes = getattr(array.array, 'frombytes', None) or array.array.fromstring
+
+
+def pack_column(typecode, values):
+    column = array.array(typecode, values)
+    if BIG_ENDIAN:
+        column.byteswap()
+    return tobytes(column)
+
+def unpack_column(typecode, data, offset, count):
+    # (column as a list, offset just past it)
+    column = array.array(typecode)
+    end = offset + count * column.itemsize
+    frombytes(column, data[offset:end])
+    if BIG_ENDIAN:
+        column.byteswap()
+    return column.tolist(), end
+
+
+class Recorder(object):
+    def __init__(self, path, num_shapes, size,
+                 keyframe_interval=KEYFRAME_INTERVAL):
+        # size is the (width, height) of the screen the run is shown on
+        self.file = open(path, 'wb')
+        self.n = num_shapes
+        self.keyframe_interval = keyframe_interval
+        self.offsets = []
+        self.last = None # (x, y, focus, age) of the last frame
+        self.file.write(HEADER.pack(MAGIC, VERSION, 0, num_shapes,
+                                    keyframe_interval, size[0], size[1]))
+
+    def record(self, tick, player, x, y, focus, kind, side, shade, age):
+        # player is the player's (x, y); the rest are columns with one value
+        # per shape. A shape whose age went down has respawned.
+        n = self.n
+        assert len(x) == n, 'the number of shapes changed'
+        self.offsets.append(self.file.tell())
+        last = self.last
+        self.last = (x, y, focus, age)
+
+        if last is not None and len(self.offsets) % self.keyframe_interval:
+            lastx, lasty, lastfocus, lastage = last
+            respawned = [i for i in range(n) if age[i] < lastage[i]]
+            dx = [x[i] - lastx[i] for i in range(n)]
+            dy = [y[i] - lasty[i] for i in range(n)]
+            for i in respawned:
+                dx[i] = dy[i] = 0
+            if (max(max(dx), max(dy), 0) <= 127 and
+                min(min(dx), min(dy), 0) >= -128):
+                changed = [i for i in range(n) if focus[i] != lastfocus[i]]
+                self.file.write(FRAME.pack(DELTA, tick, player[0], player[1],
+                                           len(respawned), len(changed)))
+                self.file.write(pack_column('b', dx))
+                self.file.write(pack_column('b', dy))
+                for i in respawned:
+                    self.file.write(RESPAWN.pack(i, kind[i], side[i],
+                                                 shade[i], x[i], y[i]))
+                self.file.write(pack_column('I', changed))
+                self.file.write(pack_column('i',
+                                            [focus[i] for i in changed]))
+                return
+
+        self.file.write(FRAME.pack(KEY, tick, player[0], player[1], 0, 0))
+        for typecode, column in (('i', x), ('i', y), ('B', kind),
+                                 ('H', side), ('B', shade), ('i', focus)):
+            self.file.write(pack_column(typecode, column))
+
+    def close(self):
+        if self.file is None:
+            return
+        index = self.file.tell()
+        self.file.write(struct.pack('<%dQ' % len(self.offsets),
+                                    *self.offsets))
+        self.file.write(TRAILER.pack(index, len(self.offsets), END_MAGIC))
+        self.file.close()
+        self.file = None
+
+# end class Recorder
+
+class Replay(object):
+    # a recording, memory-mapped. seek(frame) rebuilds the world as it was
+    # in that frame into x, y, kind, side, shade, focus (one value per
+    # shape), player and tick; step() moves on to the next frame. size is
+    # the screen the run was recorded on.
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, unused, self.n, self.keyframe_interval,
+         width, height) = HEADER.unpack_from(self.data, 0)
+        assert magic == MAGIC and version == VERSION, 'not a recording'
+        self.size = (width, height)
+
+        index, self.frames, end = TRAILER.unpack_from(
+            self.data, len(self.data) - TRAILER.size)
+        assert end == END_MAGIC, 'recording was not closed properly'
+        self.offsets = list(struct.unpack_from('<%dQ' % self.frames,
+                                               self.data, index))
+        self.keyframes = [frame for frame, offset in enumerate(self.offsets)
+                          if KIND.unpack_from(self.data, offset)[0] == KEY]
+        self.frame = None
+
+    def __len__(self):
+        return self.frames
+
+    def seek(self, frame):
+        # (going backwards, or far forwards, starts again from a keyframe)
+        frame = max(0, min(frame, self.frames - 1))
+        keyframe = self.last_keyframe(frame)
+        if self.frame is None or not keyframe <= self.frame <= frame:
+            self.read(keyframe)
+        while self.frame < frame:
+            self.read(self.frame + 1)
+
+    def step(self):
+        # False at the end of the recording
+        if self.frame is None:
+            self.read(0)
+            return True
+        if self.frame + 1 >= self.frames:
+            return False
+        self.read(self.frame + 1)
+        return True
+
+    def last_keyframe(self, frame):
+        return self.keyframes[bisect.bisect_right(self.keyframes, frame) - 1]
+
+    def read(self, frame):
+        # apply one frame; delta frames must follow the frame before them
+        data = self.data
+        n = self.n
+        offset = self.offsets[frame]
+        kind, self.tick, px, py, respawns, changes = \
+            FRAME.unpack_from(data, offset)
+        self.player = (px, py)
+        offset += FRAME.size
+
+        if kind == KEY:
+            self.x, offset = unpack_column('i', data, offset, n)
+            self.y, offset = unpack_column('i', data, offset, n)
+            self.kind, offset = unpack_column('B', data, offset, n)
+            self.side, offset = unpack_column('H', data, offset, n)
+            self.shade, offset = unpack_column('B', data, offset, n)
+            self.focus, offset = unpack_column('i', data, offset, n)
+        else:
+            assert self.frame == frame - 1
+            dx, offset = unpack_column('b', data, offset, n)
+            dy, offset = unpack_column('b', data, offset, n)
+            self.x = [x + d for x, d in zip(self.x, dx)]
+            self.y = [y + d for y, d in zip(self.y, dy)]
+            for r in range(respawns):
+                i, kind, side, shade, x, y = RESPAWN.unpack_from(data, offset)
+                offset += RESPAWN.size
+                self.kind[i] = kind
+                self.side[i] = side
+                self.shade[i] = shade
+                self.x[i] = x
+                self.y[i] = y
+            changed, offset = unpack_column('I', data, offset, changes)
+            foci, offset = unpack_column('i', data, offset, changes)
+            for i, focus in zip(changed, foci):
+                self.focus[i] = focus
+        self.frame = frame
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+# end class Replay
@@ -0,0 +1,103 @@
+"""
+Version 3's decision rules, compiled into a table.
+
+Shape.where_to only ever looks at five things: the two shapes' types, how
+different their shades are (preferred, merely tolerated, or not tolerated,
+by the standards of the deciding shape's type), whether the other one is
+inside its personal space, and which way the other one is. None of that
+depends on anything but SHAPE_TYPES and the shared Personality of each type,
+so all the vote arrays that can come out of it are worked out once, up
+front, and deciding is a matter of looking one up:
+
+    votes[kind][other_kind][buckets[kind][shade difference]][invaded][pair]
+
+where pair = pair_of(xdist, ydist). Both the Shape objects and the array
+engines use the same table.
+"""
+
+from __future__ import division, print_function
+
+# these must agree with the direction constants in clique
+UP = 0
+DOWN = 1
+RIGHT = 2
+LEFT = 3
+STAY = 4
+
+# how a shade difference looks to a shape
+PREFERRED = 0
+TOLERATED = 1
+INTOLERANT = 2
+
+MAX_SHADE = 255
+
+# (approach, avoid) for each kind of relative position, as chosen by the
+# game's closer() and further() functions (see pair_of)
+PAIRS = [(LEFT, RIGHT), (RIGHT, LEFT), (UP, DOWN), (DOWN, UP), (STAY, UP)]
+
+
+def pair_of(xdist, ydist):
+    # the index into PAIRS for a neighbour at (xdist, ydist): the axis of
+    # greatest distance is the one to move along
+    if abs(xdist) > abs(ydist):
+        if xdist > 0:
+            return 0
+        return 1
+    if ydist > 0:
+        return 2
+    if xdist == 0 and ydist == 0:
+        return 4
+    return 3
+
+def shade_bucket(persona, shadediff):
+    if shadediff <= persona.shade_preferance:
+        return PREFERRED
+    if shadediff <= persona.shade_tolerance:
+        return TOLERATED
+    return INTOLERANT
+
+def rule_votes(kind, other_kind, bucket, invaded):
+    # the rules of Shape.where_to: (votes to approach, votes to avoid)
+    approach = avoid = 0
+    if invaded:
+        avoid += 2
+    if kind == other_kind:
+        approach += 1
+    if abs(kind - other_kind) > 2:
+        avoid += 1
+    if bucket == PREFERRED:
+        approach += 1
+    elif bucket == INTOLERANT:
+        avoid += 1
+    return approach, avoid
+
+
+class RuleTable(object):
+    def __init__(self, shape_types, personalities):
+        # shape_types is the list of type names, whose indices are the kinds;
+        # personalities maps each type name to its Personality
+        kinds = range(len(shape_types))
+        personas = [personalities[shape_type] for shape_type in shape_types]
+
+        # buckets[kind][shade difference]
+        self.buckets = [[shade_bucket(persona, shadediff)
+                         for shadediff in range(MAX_SHADE + 1)]
+                        for persona in personas]
+
+        # votes[kind][other_kind][bucket][invaded][pair], each a tuple of
+        # votes in the order of the direction constants
+        self.votes = [[[[[self.vote_array(rule_votes(kind, other_kind,
+                                                     bucket, invaded), pair)
+                          for pair in PAIRS]
+                         for invaded in (False, True)]
+                        for bucket in (PREFERRED, TOLERATED, INTOLERANT)]
+                       for other_kind in kinds]
+                      for kind in kinds]
+
+    def vote_array(self, rule, pair):
+        votes = [0, 0, 0, 0, 1]
+        votes[pair[0]] += rule[0]
+        votes[pair[1]] += rule[1]
+        return tuple(votes)
+
+# end class RuleTable
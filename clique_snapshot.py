@@ -0,0 +1,138 @@
+"""
+Saving and loading the complete state of a world, for warm starts.
+
+Crowds only start to cluster after thousands of ticks, so rather than run the
+warm-up again every time, a warmed-up world can be saved and later carried
+on from exactly where it left off. A snapshot holds every shape as columns
+(one array per attribute, written and read in bulk, with nothing pickled)
+along with the camera, the tick count and the state of the random number
+generators, so a loaded world goes on to do just what the saved one would
+have.
+
+    header    '<4sHHIiiiiqq'  magic, version, 0, shapes, screen width and
+                              height, OFFSET x and y, ticks, LOD scheduler
+                              tick
+    RAND      '<iIBd'         random.getstate()'s version, number of ints
+                              in its internal state, whether it has a
+                              gauss_next and the gauss_next; then the ints
+                              (uint32)
+    engine    '<I'            length of the engine's random state as JSON
+                              (0 if there is none), then the JSON
+    extras    '<I'            number of extra columns, then for each one
+                              '<B' length of its name, the name and its
+                              array typecode
+    columns   one array after another, in the order of COLUMNS, then the
+              extra columns
+
+Personalities shared by every shape of a type aren't stored. Policies with
+per-shape state of their own (see Shape.EXTRA_COLUMNS) add it as extra
+columns.
+"""
+
+from __future__ import division, print_function
+import json, struct
+from clique_record import pack_column, unpack_column
+
+MAGIC = b'CLQS'
+VERSION = 2
+
+HEADER = struct.Struct('<4sHHIiiiiqq')
+RANDOM = struct.Struct('<iIBd')
+LENGTH = struct.Struct('<I')
+NAME = struct.Struct('<B')
+
+# (name, array typecode); kind is the index of the shape type, and focus the
+# index of the focused shape, the number of shapes for the player, or -1 for
+# nobody
+COLUMNS = [('x', 'i'), ('y', 'i'), ('nextx', 'i'), ('nexty', 'i'),
+           ('kind', 'B'), ('side', 'H'), ('shade', 'B'), ('age', 'i'),
+           ('focus', 'i'), ('updated', 'i')]
+
+
+class Snapshot(object):
+    def __init__(self, size, offset, ticks, lod_tick, rand_state,
+                 engine_state, columns, extra_columns=()):
+        # rand_state is what random.Random.getstate() returns, engine_state
+        # anything JSON can hold (or None), and columns a dict of lists, one
+        # for each name in COLUMNS and in extra_columns, a list of
+        # (name, array typecode) like COLUMNS
+        self.size = tuple(size)
+        self.offset = tuple(offset)
+        self.ticks = ticks
+        self.lod_tick = lod_tick
+        self.rand_state = rand_state
+        self.engine_state = engine_state
+        self.columns = columns
+        self.extra_columns = list(extra_columns)
+
+    def __len__(self):
+        return len(self.columns['x'])
+
+    def save(self, path):
+        version, internal, gauss_next = self.rand_state
+        if self.engine_state is None:
+            engine_state = b''
+        else:
+            engine_state = json.dumps(self.engine_state).encode('ascii')
+
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, 0, len(self),
+                                self.size[0], self.size[1],
+                                self.offset[0], self.offset[1],
+                                self.ticks, self.lod_tick))
+            f.write(RANDOM.pack(version, len(internal),
+                                gauss_next is not None,
+                                gauss_next if gauss_next is not None else 0))
+            f.write(pack_column('I', internal))
+            f.write(LENGTH.pack(len(engine_state)))
+            f.write(engine_state)
+            f.write(LENGTH.pack(len(self.extra_columns)))
+            for name, typecode in self.extra_columns:
+                name = name.encode('ascii')
+                f.write(NAME.pack(len(name)))
+                f.write(name)
+                f.write(typecode.encode('ascii'))
+            for name, typecode in COLUMNS + self.extra_columns:
+                assert len(self.columns[name]) == len(self)
+                f.write(pack_column(typecode, self.columns[name]))
+
+# end class Snapshot
+
+def load(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    (magic, version, unused, n, width, height, offset_x, offset_y, ticks,
+     lod_tick) = HEADER.unpack_from(data, 0)
+    assert magic == MAGIC and version == VERSION, 'not a snapshot'
+    offset = HEADER.size
+
+    rand_version, count, has_gauss, gauss_next = \
+        RANDOM.unpack_from(data, offset)
+    internal, offset = unpack_column('I', data, offset + RANDOM.size, count)
+    rand_state = (rand_version, tuple(internal),
+                  gauss_next if has_gauss else None)
+
+    length, = LENGTH.unpack_from(data, offset)
+    offset += LENGTH.size
+    engine_state = None
+    if length:
+        engine_state = json.loads(data[offset:offset + length].decode('ascii'))
+    offset += length
+
+    count, = LENGTH.unpack_from(data, offset)
+    offset += LENGTH.size
+    extra_columns = []
+    for i in range(count):
+        length, = NAME.unpack_from(data, offset)
+        offset += NAME.size
+        name = data[offset:offset + length].decode('ascii')
+        typecode = data[offset + length:offset + length + 1].decode('ascii')
+        offset += length + 1
+        extra_columns.append((name, typecode))
+
+    columns = {}
+    for name, typecode in COLUMNS + extra_columns:
+        columns[name], offset = unpack_column(typecode, data, offset, n)
+    return Snapshot((width, height), (offset_x, offset_y), ticks, lod_tick,
+                    rand_state, engine_state, columns, extra_columns)
@@ -0,0 +1,267 @@
+"""
+Uniform-grid spatial index for shapes.
+
+Shapes live on an unbounded integer plane, so the grid is a dict of occupied
+cells rather than a fixed 2d array. Items are stored along with the order in
+which they were inserted; when two items are the same distance away, the one
+inserted first wins, which reproduces the tie-breaking of a linear scan over
+the same list.
+"""
+
+from __future__ import division, print_function
+import collections
+
+CELL_SIZE = 100
+# fit_cell_size aims for each item to share its cell with about this many
+# items on average
+POINTS_PER_CELL = 2
+INFINITY = float('inf')
+
+
+def fit_cell_size(xs, ys):
+    # a cell size for items at (xs[i], ys[i]), the same way
+    # clique_numpy.fit_cell_size picks one: the first guess spreads them
+    # evenly over the box they take up; if they are bunched up (or a few
+    # strays make the box huge), the cells are shrunk by how much more
+    # crowded they turned out to be than that
+    n = len(xs)
+    if n == 0:
+        return CELL_SIZE
+    minx = min(xs)
+    miny = min(ys)
+    area = float(max(xs) - minx + 1) * float(max(ys) - miny + 1)
+    size = max(1, int(round((area * POINTS_PER_CELL / n) ** 0.5)))
+    counts = collections.Counter(zip([x // size for x in xs],
+                                     [y // size for y in ys]))
+    crowding = (sum(count * count for count in counts.values()) /
+                (n * POINTS_PER_CELL))
+    return max(1, int(round(size / max(crowding, 1) ** 0.5)))
+
+
+
+class SpatialGrid(object):
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.clear()
+
+    def clear(self):
+        self.cells = {}
+        self.entries = {} # each item's entry, for move and remove
+        self.count = 0
+        self.radius = 0 # the largest radius of anything inserted
+        # bounds of the occupied cells, so ring searches know when to give up
+        self.mincx = self.mincy = None
+        self.maxcx = self.maxcy = None
+
+    def cell_of(self, x, y):
+        return (int(x // self.cell_size), int(y // self.cell_size))
+
+    def insert(self, item, x, y, radius=0):
+        # radius is how far the item reaches from (x, y), for query_rect
+        self.place((self.count, x, y, item), radius)
+        self.count += 1
+
+    def place(self, entry, radius):
+        # file an entry under its cell
+        cx, cy = key = self.cell_of(entry[1], entry[2])
+        self.entries[entry[3]] = entry
+        if radius > self.radius:
+            self.radius = radius
+
+        bucket = self.cells.get(key)
+        if bucket is None:
+            self.cells[key] = [entry]
+        else:
+            bucket.append(entry)
+
+        if self.mincx is None:
+            self.mincx = self.maxcx = cx
+            self.mincy = self.maxcy = cy
+        else:
+            if cx < self.mincx: self.mincx = cx
+            elif cx > self.maxcx: self.maxcx = cx
+            if cy < self.mincy: self.mincy = cy
+            elif cy > self.maxcy: self.maxcy = cy
+
+    def rebuild(self, entries, cell_size=None):
+        # entries is an iterable of (item, x, y, radius), in tie-breaking
+        # order; the grid switches to cell_size first, if it's given
+        if cell_size is not None:
+            self.cell_size = cell_size
+        self.clear()
+        for item, x, y, radius in entries:
+            self.insert(item, x, y, radius)
+
+    def remove(self, item, x, y):
+        # take out an item inserted at (x, y). (The bounds of the occupied
+        # cells are left as they are, which only makes searches look further
+        # than they have to.)
+        bucket = self.cells.get(self.cell_of(x, y))
+        if bucket is not None:
+            for i, entry in enumerate(bucket):
+                if entry[3] is item:
+                    del bucket[i]
+                    del self.entries[item]
+                    return
+
+    def move(self, item, x, y, radius=0):
+        # put an item already in the grid at (x, y) instead, keeping its
+        # place in the insertion order (buckets aren't kept in order; every
+        # query sorts or compares by it). As with remove, the bounds only
+        # ever grow.
+        entry = self.entries[item]
+        if entry[1] == x and entry[2] == y:
+            if radius > self.radius:
+                self.radius = radius
+            return
+        self.remove(item, entry[1], entry[2])
+        self.place((entry[0], x, y, item), radius)
+
+    def ring(self, cx, cy, r):
+        # every cell whose chebyshev distance from (cx, cy) is exactly r
+        if r == 0:
+            yield (cx, cy)
+            return
+        for x in range(cx - r, cx + r + 1):
+            yield (x, cy - r)
+            yield (x, cy + r)
+        for y in range(cy - r + 1, cy + r):
+            yield (cx - r, y)
+            yield (cx + r, y)
+
+    def max_ring(self, cx, cy):
+        # beyond this ring there are no occupied cells at all
+        return max(cx - self.mincx, self.maxcx - cx,
+                   cy - self.mincy, self.maxcy - cy)
+
+    def coverage(self, left, top, right, bottom):
+        # the fraction (0 to 1) of the box of occupied cells that the
+        # cells under the rectangle take up; 0 for an empty grid
+        if self.count == 0:
+            return 0.0
+        mincx, mincy = self.cell_of(left, top)
+        maxcx, maxcy = self.cell_of(right, bottom)
+        width = min(maxcx, self.maxcx) - max(mincx, self.mincx) + 1
+        height = min(maxcy, self.maxcy) - max(mincy, self.mincy) + 1
+        if width <= 0 or height <= 0:
+            return 0.0
+        return (width * height /
+                ((self.maxcx - self.mincx + 1) * (self.maxcy - self.mincy + 1)))
+
+    def query_rect(self, left, top, right, bottom):
+        # every item that might reach into the rectangle, in insertion order:
+        # the cells searched are widened by the largest radius inserted, so
+        # a few items that don't quite reach it may be included as well
+        if self.count == 0:
+            return []
+        cells = self.cells
+        pad = self.radius
+        mincx, mincy = self.cell_of(left - pad, top - pad)
+        maxcx, maxcy = self.cell_of(right + pad, bottom + pad)
+        mincx = max(mincx, self.mincx)
+        mincy = max(mincy, self.mincy)
+        maxcx = min(maxcx, self.maxcx)
+        maxcy = min(maxcy, self.maxcy)
+
+        found = []
+        for cx in range(mincx, maxcx + 1):
+            for cy in range(mincy, maxcy + 1):
+                bucket = cells.get((cx, cy))
+                if bucket is not None:
+                    found.extend(bucket)
+        found.sort()
+        return [entry[3] for entry in found]
+
+    def query_radius(self, x, y, radius):
+        # every item strictly less than radius away from (x, y) in a straight
+        # line, as (item, xdist, ydist, squared distance) in insertion order
+        # (the same convention for xdist and ydist as nearest). Distances are
+        # compared squared, so no square roots are taken.
+        if self.count == 0:
+            return []
+        cells = self.cells
+        mincx, mincy = self.cell_of(x - radius, y - radius)
+        maxcx, maxcy = self.cell_of(x + radius, y + radius)
+        mincx = max(mincx, self.mincx)
+        mincy = max(mincy, self.mincy)
+        maxcx = min(maxcx, self.maxcx)
+        maxcy = min(maxcy, self.maxcy)
+        size = self.cell_size
+        limit = radius * radius
+
+        found = []
+        for cx in range(mincx, maxcx + 1):
+            # (how far the column of cells is from x, if it doesn't hold x)
+            xgap = max(cx * size - x, x - (cx + 1) * size, 0)
+            for cy in range(mincy, maxcy + 1):
+                bucket = cells.get((cx, cy))
+                if bucket is None:
+                    continue
+                # skip cells in the corners of the square that are wholly
+                # outside the circle
+                ygap = max(cy * size - y, y - (cy + 1) * size, 0)
+                if xgap * xgap + ygap * ygap >= limit:
+                    continue
+                for entry in bucket:
+                    xdist = x - entry[1]
+                    ydist = y - entry[2]
+                    squared = xdist * xdist + ydist * ydist
+                    if squared < limit:
+                        found.append((entry[0], entry[3], xdist, ydist,
+                                      squared))
+        found.sort()
+        return [entry[1:] for entry in found]
+
+    def nearest(self, x, y, exclude=None):
+        # returns (item, xdist, ydist, totaldist) for the item nearest to
+        # (x, y) by manhattan distance, where xdist = x - item_x and
+        # ydist = y - item_y (the same convention as Shape.move), or None if
+        # the grid holds nothing but the excluded item
+        found = self.nearest_with_margin(x, y, exclude)
+        if found is None:
+            return None
+        return found[:4]
+
+    def nearest_with_margin(self, x, y, exclude=None):
+        # the same as nearest, plus a fifth value: every other item (except
+        # the excluded one) is at least this far away, and at least as far
+        # as the nearest. Infinite if there is no other item.
+        if self.count == 0:
+            return None
+
+        cells = self.cells
+        cx, cy = self.cell_of(x, y)
+        last = self.max_ring(cx, cy)
+
+        best = None # (order, item, xdist, ydist, totaldist)
+        second = INFINITY # distance to the runner-up
+        r = 0
+        while r <= last:
+            for key in self.ring(cx, cy, r):
+                bucket = cells.get(key)
+                if bucket is None: continue
+                for order, ix, iy, item in bucket:
+                    if item is exclude: continue
+                    xdist = x - ix
+                    ydist = y - iy
+                    totaldist = abs(xdist) + abs(ydist)
+                    if (best is None or totaldist < best[4] or
+                        (totaldist == best[4] and order < best[0])):
+                        if best is not None and best[4] < second:
+                            second = best[4]
+                        best = (order, item, xdist, ydist, totaldist)
+                    elif totaldist < second:
+                        second = totaldist
+
+            # anything in an unvisited cell is more than r cells away along
+            # at least one axis, so it must be further than r * cell_size
+            if best is not None and best[4] <= r * self.cell_size:
+                second = min(second, r * self.cell_size)
+                break
+            r += 1
+
+        if best is None:
+            return None
+        return best[1:] + (second,)
+
+# end class SpatialGrid
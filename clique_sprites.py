@@ -0,0 +1,60 @@
+"""
+Cache of pre-rendered shape sprites.
+
+Drawing a shape with pygame.draw means rasterizing a filled polygon and its
+outline every frame, but a shape's appearance only depends on its type, size
+and shade, so each combination is rasterized once onto a small Surface and
+after that the shape is just blitted. The least recently used sprites are
+thrown away when the cache is full.
+"""
+
+from __future__ import division, print_function
+import collections
+
+CACHE_SIZE = 8192
+
+
+class SpriteCache(object):
+    def __init__(self, rasterize, capacity=CACHE_SIZE):
+        # rasterize(key) must return (surface, anchor), where anchor is the
+        # pixel of the surface that belongs at the shape's position
+        self.rasterize = rasterize
+        self.capacity = capacity
+        self.sprites = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        sprites = self.sprites
+        sprite = sprites.pop(key, None)
+        if sprite is None:
+            self.misses += 1
+            sprite = self.rasterize(key)
+            if len(sprites) >= self.capacity:
+                sprites.popitem(last=False)
+        else:
+            self.hits += 1
+        # (re)inserting puts it at the most recently used end
+        sprites[key] = sprite
+        return sprite
+
+    def resize(self, capacity):
+        # keep at most capacity sprites from now on, dropping the least
+        # recently used ones if there are more already
+        self.capacity = capacity
+        while len(self.sprites) > capacity:
+            self.sprites.popitem(last=False)
+
+    def clear(self):
+        self.sprites.clear()
+
+# end class SpriteCache
+
+def blit_all(surface, blits):
+    # blits is a list of (source, dest) pairs, drawn in order; Surface.blits
+    # does them all in one call, but older pygames don't have it
+    if hasattr(surface, 'blits'):
+        surface.blits(blits, False)
+    else:
+        for source, dest in blits:
+            surface.blit(source, dest)
@@ -0,0 +1,894 @@
+"""
+Seeded equivalence tests for the simulation in clique.
+
+Most of the speedups are meant to change nothing but the speed, so each test
+runs the same seeded World both ways, with the player moving now and then,
+and compares the shapes (or what ends up on the screen) after every tick.
+
+    python -m pytest -q test_clique.py
+"""
+
+from __future__ import division, print_function
+import random, subprocess, sys
+import pytest
+import pygame
+import clique
+import clique_main_3
+import clique_profile
+from clique_policies import POLICIES
+from clique_dirty import DirtyRects
+from clique_chunks import ChunkStore, Pager
+from clique_record import Replay
+
+SEED = 11
+NUM_SHAPES = 150
+TICKS = 120
+# short enough that plenty of shapes respawn during a test
+MAX_AGE = 60
+
+# the player moves every few ticks, so the camera (and with it the LOD bands
+# and the focus cache's bounds on the player) doesn't stand still
+PLAYER_MOVES = [clique.RIGHT, clique.RIGHT, clique.DOWN, clique.LEFT,
+                clique.UP, clique.UP]
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    # every test starts from the default settings, with short lives; tests
+    # change them with monkeypatch, which puts them back afterwards
+    for name in ['USE_GRID', 'GRID_CELL_SIZE', 'FOCUS_CACHE', 'LOD', 'CHUNKS',
+                 'ENGINE', 'WORKERS', 'RECORD_PATH', 'NUM_SHAPES',
+                 'SPRITE_CACHE_SIZE']:
+        monkeypatch.setattr(clique, name, getattr(clique, name))
+    monkeypatch.setattr(clique, 'MAX_AGE', MAX_AGE)
+
+def state(world):
+    # everything about the shapes that can be compared between runs (on any
+    # engine)
+    return (world.columns(), tuple(clique.grid_position(clique.player)))
+
+def run(world, ticks, first=0):
+    # step the world, moving the player now and then; returns the state
+    # after every tick
+    states = []
+    for tick in range(first, first + ticks):
+        if tick % 5 == 0:
+            clique.move_player(PLAYER_MOVES[tick // 5 % len(PLAYER_MOVES)])
+        world.tick()
+        states.append(state(world))
+    return states
+
+def scatter(world):
+    # shapes are born on the screen; send a third of them into each LOD band
+    for i, shape in enumerate(world.shapes):
+        if shape != world.player:
+            distance = [0, 800, 3000][i % 3]
+            shape.pos[0] = shape.nextpos[0] = shape.pos[0] + distance
+    if clique.USE_GRID and world.engine is None:
+        clique.index_shapes()
+
+def simulate(engine='objects', ticks=TICKS, version=3, **settings):
+    for name, value in settings.items():
+        setattr(clique, name, value)
+    world = clique.World(NUM_SHAPES, seed=SEED, engine=engine,
+                         shape_class=POLICIES[version])
+    scatter(world)
+    return run(world, ticks)
+
+
+@pytest.mark.parametrize('version', [1, 2, 3])
+def test_grid(version):
+    assert (simulate(version=version, USE_GRID=True) ==
+            simulate(version=version, USE_GRID=False))
+
+@pytest.mark.parametrize('coverage', [0, 2])
+def test_grid_or_scan(monkeypatch, coverage):
+    # version 1 only asks the grid when its line of sight takes in little of
+    # the crowd; either way it has to see the same shapes
+    import clique_policies
+    monkeypatch.setattr(clique_policies, 'SCAN_SHAPES', 0)
+    monkeypatch.setattr(clique_policies, 'SCAN_COVERAGE', coverage)
+    assert (simulate(version=1, USE_GRID=True) ==
+            simulate(version=1, USE_GRID=False))
+
+@pytest.mark.parametrize('version', [1, 2, 3])
+def test_focus_cache(version):
+    assert (simulate(version=version, FOCUS_CACHE=True) ==
+            simulate(version=version, FOCUS_CACHE=False))
+
+def test_no_focus_cache_with_lod():
+    # (see clique.FOCUS_CACHE)
+    simulate(ticks=1, FOCUS_CACHE=True, LOD=True)
+    assert clique.focus_cache is None
+
+def test_visible_shapes():
+    # the camera sweeps about (between steps, as it does in the game), and
+    # the grid's viewport query has to find what a full scan would
+    world = clique.World(NUM_SHAPES, seed=SEED)
+    partly = False
+    for tick in range(TICKS):
+        world.tick()
+        for i in range(10):
+            clique.move_player(PLAYER_MOVES[tick // 20 % len(PLAYER_MOVES)])
+        scanned = [shape for shape in world.shapes
+                   if shape != world.player and shape.onscreen()]
+        assert world.visible_shapes() == scanned
+        partly = partly or 0 < len(scanned) < NUM_SHAPES
+    assert partly
+
+@pytest.mark.parametrize('lod, chunks', [(False, False), (True, False),
+                                         (True, True)])
+def test_reindex(monkeypatch, lod, chunks):
+    # the grid is only brought up to date with the shapes that moved, and
+    # rebuilt when the world is paged; either way it has to end up holding
+    # every shape where it is, in the order of the list of shapes, with the
+    # cells the size they were first given
+    monkeypatch.setattr(clique, 'CHUNK_SIZE', 500)
+    clique.LOD = lod
+    clique.CHUNKS = chunks
+    world = clique.World(NUM_SHAPES, seed=SEED)
+    scatter(world)
+    cell_size = clique.grid.cell_size
+    for tick in range(TICKS):
+        if tick % 5 == 0:
+            clique.move_player(PLAYER_MOVES[tick // 5 % len(PLAYER_MOVES)])
+        world.tick()
+        population = [shape for shape in world.shapes
+                      if shape != world.player]
+        entries = sorted(entry for entry in clique.grid.entries.values()
+                         if entry[3] != world.player)
+        assert [entry[3] for entry in entries] == population
+        assert all(entry[1:3] == tuple(entry[3].pos) for entry in entries)
+        assert clique.grid.cell_size == cell_size
+    world.close()
+
+def same_draw(first, second, *args):
+    # what first and second each return given the same RAND state
+    state = clique.RAND.getstate()
+    a = first(*args)
+    clique.RAND.setstate(state)
+    b = second(*args)
+    return a, b
+
+def unit_walk(votes, uniform=None):
+    # best_dir as it was, counting down through the votes one at a time
+    # (uniform is the random number to use, if not RAND's next)
+    if uniform is None: uniform = clique.RAND.random()
+    total = 0
+    for vote in votes: total += vote
+    position = (uniform * total) + 1
+    index = total
+    for i in range(len(votes)):
+        for j in range(votes[i]):
+            if index <= position: return i
+            index -= 1
+    assert False
+
+def test_best_dir():
+    rand = random.Random(SEED)
+    clique.RAND.seed(SEED)
+    patterns = [[0, 0, 0, 0, 1], [1, 1, 1, 1, 1], [0, 3, 0, 0, 1],
+                [4, 0, 0, 2, 1]]
+    for i in range(20000):
+        patterns.append([rand.choice([0, 0, 1, 2, 5]) for j in range(4)] +
+                        [rand.randint(1, 3)])
+    for votes in patterns:
+        chosen, expected = same_draw(clique.best_dir, unit_walk, votes)
+        assert chosen == expected, votes
+
+def test_sample_directions():
+    # the array engines' batched version of best_dir
+    np = pytest.importorskip('numpy')
+    import clique_numpy
+    rand = random.Random(SEED)
+    votes = [[rand.choice([0, 0, 1, 2, 5]) for j in range(4)] +
+             [rand.randint(1, 3)] for i in range(5000)]
+    uniforms = [rand.random() for vote in votes]
+    countdown, total = clique_numpy.countdowns(np.array(votes))
+    chosen = clique_numpy.sample_directions(countdown, total,
+                                            np.array(uniforms))
+    for vote, uniform, direction in zip(votes, uniforms, chosen):
+        assert direction == unit_walk(vote, uniform), vote
+
+def old_where_to(shape, nearest, location):
+    # Shape.where_to as it was, adding up the votes one rule at a time
+    votes = [0, 0, 0, 0, 1]
+    xdist, ydist, totaldist = location
+    approach = clique.closer(xdist, ydist)
+    avoid = clique.further(xdist, ydist)
+    assert approach != avoid
+
+    if totaldist < shape.persona.personal_space:
+        votes[avoid] += 2
+    if shape.shape_type == nearest.shape_type:
+        votes[approach] += 1
+    if abs(clique.SHAPE_TYPES.index(shape.shape_type) -
+           clique.SHAPE_TYPES.index(nearest.shape_type)) > 2:
+        votes[avoid] += 1
+
+    shadediff = abs(shape.shade - nearest.shade)
+    if shadediff <= shape.persona.shade_preferance:
+        votes[approach] += 1
+    elif shadediff > shape.persona.shade_tolerance:
+        votes[avoid] += 1
+    return clique.best_dir(votes)
+
+def test_rule_table():
+    rand = random.Random(SEED)
+    clique.RAND.seed(SEED)
+    for i in range(20000):
+        a, b = [clique.Shape((0, 0), shape_type, 10, rand.randint(0, 255),
+                             clique.PERSONALITIES[shape_type], 0)
+                for shape_type in (rand.choice(clique.SHAPE_TYPES),
+                                   rand.choice(clique.SHAPE_TYPES))]
+        xdist = rand.randint(-100, 100)
+        ydist = rand.choice([xdist, -xdist, rand.randint(-100, 100)])
+        if i % 50 == 0:
+            xdist = ydist = 0
+        location = (xdist, ydist, abs(xdist) + abs(ydist))
+        old = lambda nearest, location: old_where_to(a, nearest, location)
+        chosen, expected = same_draw(a.where_to, old, b, location)
+        assert chosen == expected
+
+
+@pytest.mark.parametrize('max_rows', [1.0, 1000])
+def test_dirty_rects(monkeypatch, max_rows):
+    # what reaches the display through draw_frame's rectangles has to match
+    # a full redraw pixel for pixel, with camera moves and frames drawn
+    # without a step in between. (A huge max_rows never falls back to a
+    # full redraw unless the camera moves.)
+    clique.load_pygame()
+    monkeypatch.setattr(clique_main_3, 'dirty',
+                        DirtyRects(clique.WHITE, max_rows))
+    world = clique.World(30, seed=SEED)
+    screen = pygame.Surface(clique.size)
+    display = pygame.Surface(clique.size)
+    expected = pygame.Surface(clique.size)
+    partial = 0
+    for frame in range(60):
+        if frame % 3 != 2:
+            world.advance()
+        if frame % 10 == 9:
+            clique.move_player(PLAYER_MOVES[frame // 10])
+
+        changed = clique_main_3.draw_frame(world, screen)
+        if changed is None:
+            display.blit(screen, (0, 0))
+        else:
+            partial += 1
+            for rect in changed:
+                display.blit(screen, rect, rect)
+
+        expected.fill(clique.WHITE)
+        world.draw_shapes(expected)
+        world.player.render(expected)
+        assert (pygame.image.tostring(display, 'RGB') ==
+                pygame.image.tostring(expected, 'RGB')), frame
+    assert partial
+
+
+def test_templates():
+    # shapes drawn from the shared templates have to come out exactly like
+    # the polygons of their own vertices they used to carry around (made
+    # where they were born, then shifted along with them every tick)
+    clique.load_pygame()
+    rand = random.Random(SEED)
+    drawn = pygame.Surface((200, 200))
+    expected = pygame.Surface((200, 200))
+    for i in range(300):
+        shape_type = clique.SHAPE_TYPES[i % len(clique.SHAPE_TYPES)]
+        side_length = rand.randint(1, 90)
+        x = rand.randint(90, 110)
+        y = rand.randint(90, 110)
+        shape = clique.Shape((x - clique.OFFSET[0], y - clique.OFFSET[1]),
+                             shape_type, side_length, rand.randint(0, 254),
+                             clique.PERSONALITIES[shape_type], 0)
+        points = clique.makepoints((x, y), shape_type, side_length)
+        for step in range(20):
+            xstep = rand.randint(-1, 1)
+            ystep = rand.randint(-1, 1)
+            shape.nextpos[0] += xstep
+            shape.nextpos[1] += ystep
+            shape.update_position()
+            x += xstep
+            y += ystep
+            if points is not None:
+                points = [[px + xstep, py + ystep] for px, py in points]
+
+        drawn.fill(clique.WHITE)
+        shape.render(drawn)
+        expected.fill(clique.WHITE)
+        if points is None:
+            pygame.draw.circle(expected, clique.GRAYS[shape.shade], (x, y),
+                               side_length)
+            pygame.draw.circle(expected, clique.BLACK, (x, y), side_length,
+                               clique.STROKE_WIDTH)
+        else:
+            # (give or take the rounding error that template rounds off)
+            points = [(round(px, 9), round(py, 9)) for px, py in points]
+            pygame.draw.polygon(expected, clique.GRAYS[shape.shade], points)
+            pygame.draw.polygon(expected, clique.BLACK, points,
+                                clique.STROKE_WIDTH)
+
+        assert (pygame.image.tostring(drawn, 'RGB') ==
+                pygame.image.tostring(expected, 'RGB'))
+
+
+def test_paging(tmp_path):
+    # shapes spread over many chunks (far enough out that positions need
+    # more than 16 bits) are frozen as the player leaves and come back
+    # exactly as they were when it returns
+    size = 20000
+    world = clique.World(2000, seed=SEED)
+    rand = random.Random(SEED)
+    population = world.shapes[:-1]
+    for shape in population:
+        # (chunks -4 to 3 along each axis)
+        shape.pos[0] = rand.randint(-4 * size, 4 * size - 1)
+        shape.pos[1] = rand.randint(-4 * size, 4 * size - 1)
+    records = [clique.freeze_shape(shape) for shape in population]
+
+    pager = Pager(ChunkStore(str(tmp_path)), clique.freeze_shape,
+                  world.thaw_shape, chunk_size=size, radius=1)
+    resident = pager.page(population, 0, 0)
+    assert len(pager.store.stored) == 64 - 9
+
+    for x, y in [(0, 0), (3 * size, 0), (10 * size, 10 * size),
+                 (-2 * size, 3 * size), (0, 0), (3 * size, 0)]:
+        resident = pager.page(resident, x, y)
+        cx, cy = pager.chunk_of(x, y)
+        expected = [record for record in records
+                    if abs(record[0] // size - cx) <= 1 and
+                       abs(record[1] // size - cy) <= 1]
+        assert (sorted(clique.freeze_shape(shape) for shape in resident) ==
+                sorted(expected))
+
+    for x in range(-4 * size, 4 * size, size):
+        for y in range(-4 * size, 4 * size, size):
+            resident += pager.page([], x, y)
+    assert not pager.store.stored
+    assert (sorted(clique.freeze_shape(shape) for shape in resident) ==
+            sorted(records))
+    pager.close()
+
+
+def test_world_buffer():
+    # the back buffer starts off as a copy of the front, and nothing written
+    # to it shows in the front until the swap
+    pytest.importorskip('numpy')
+    from clique_buffer import WorldBuffer
+    buffer = WorldBuffer(3)
+    front = buffer.front()
+    front.x[:] = [1, 2, 3]
+    front.age[:] = [4, 5, 6]
+    buffer.begin_tick()
+    back = buffer.back()
+    assert back is not front
+    assert (back.x.tolist(), back.age.tolist()) == ([1, 2, 3], [4, 5, 6])
+    back.x += 1
+    back.age[0] = 0
+    assert (front.x.tolist(), front.age.tolist()) == ([1, 2, 3], [4, 5, 6])
+    buffer.swap()
+    assert buffer.front() is back and buffer.back() is front
+    assert buffer.front().age.tolist() == [0, 5, 6]
+
+def test_world_buffer_shared():
+    # a buffer attached by name shares everything with the one that made it
+    # (which buffer is in front, too); only the one that made it destroys it
+    pytest.importorskip('numpy')
+    from multiprocessing import shared_memory
+    from clique_buffer import WorldBuffer
+    made = WorldBuffer(3, shared=True)
+    attached = WorldBuffer(3, name=made.name)
+    made.front().x[:] = [7, 8, 9]
+    made.swap()
+    assert attached.back().x.tolist() == [7, 8, 9]
+    attached.front().y[0] = 5
+    assert made.front().y[0] == 5
+    attached.close()
+    assert made.back().x.tolist() == [7, 8, 9]
+    name = made.name
+    made.close()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
+
+def test_front_buffer_unchanged():
+    # nothing the numpy engine does during a tick (respawns included) shows
+    # in the front buffer it started from
+    pytest.importorskip('numpy')
+    from clique_buffer import FIELDS
+    world = clique.World(NUM_SHAPES, seed=SEED, engine='numpy')
+    respawned = False
+    for tick in range(TICKS):
+        front = world.engine.buffer.front()
+        before = [getattr(front, field).copy() for field in FIELDS]
+        world.advance()
+        assert world.engine.buffer.front() is not front
+        for field, values in zip(FIELDS, before):
+            assert (getattr(front, field) == values).all()
+        respawned = respawned or (world.engine.age < front.age).any()
+    assert respawned
+
+
+def simulate_engine(engine, ticks=40):
+    # like simulate, but closing the world (and any workers) afterwards
+    world = clique.World(NUM_SHAPES, seed=SEED, engine=engine)
+    try:
+        return run(world, ticks)
+    finally:
+        world.close()
+
+def test_parallel():
+    # the same seed gives the same world however many workers share the
+    # move phase, and the same as the numpy engine
+    pytest.importorskip('numpy')
+    expected = simulate_engine('numpy')
+    for workers in [1, 3]:
+        clique.WORKERS = workers
+        assert simulate_engine('parallel') == expected
+
+def test_parallel_close():
+    # closing the world destroys the shared memory the workers used
+    pytest.importorskip('numpy')
+    from multiprocessing import shared_memory
+    world = clique.World(NUM_SHAPES, seed=SEED, engine='parallel')
+    world.tick()
+    name = world.engine.buffer.name
+    world.close()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
+
+
+@pytest.mark.parametrize('engine', ['objects', 'numpy'])
+def test_record_replay(tmp_path, engine):
+    if engine != 'objects':
+        pytest.importorskip('numpy')
+    path = str(tmp_path / 'world.rec')
+    world = clique.World(NUM_SHAPES, (640, 480), seed=SEED, engine=engine,
+                         record_path=path)
+    try:
+        states = [state(world)] + run(world, TICKS)
+    finally:
+        world.close()
+
+    recording = Replay(path)
+    try:
+        assert len(recording) == len(states)
+        assert recording.size == (640, 480)
+
+        def check(frame):
+            assert recording.tick == frame
+            columns, player = states[frame]
+            assert (recording.x, recording.y, recording.focus,
+                    recording.kind, recording.side, recording.shade) == \
+                   tuple(columns[:6])
+            assert tuple(recording.player) == player
+
+        for frame in range(len(states)):
+            assert recording.step()
+            check(frame)
+        assert not recording.step()
+        for frame in [0, TICKS, TICKS // 2, 1, TICKS // 2 - 1, 0]:
+            recording.seek(frame)
+            check(frame)
+    finally:
+        recording.close()
+
+
+def test_replay_size(monkeypatch, tmp_path):
+    # a recording plays back on a screen the size of the one it was recorded
+    # on, whatever clique.size is by then
+    monkeypatch.setenv('SDL_VIDEODRIVER', 'dummy')
+    monkeypatch.setattr(clique, 'size', clique.size)
+    path = str(tmp_path / 'world.rec')
+    world = clique.World(NUM_SHAPES, (640, 480), seed=SEED, record_path=path)
+    try:
+        run(world, 5)
+    finally:
+        world.close()
+
+    clique.size = (1200, 900)
+    sizes = []
+    def get_events():
+        sizes.append(pygame.display.get_surface().get_size())
+        if len(sizes) > 3:
+            return [pygame.event.Event(pygame.QUIT)]
+        return []
+    monkeypatch.setattr(pygame.event, 'get', get_events)
+    clique_main_3.replay(Replay(path), 25)
+    assert set(sizes) == set([(640, 480)])
+
+
+@pytest.mark.parametrize('engine, version', [('objects', 1),
+                                             ('objects', 2),
+                                             ('objects', 3),
+                                             ('numpy', 3)])
+@pytest.mark.parametrize('lod', [False, True])
+def test_save_load(tmp_path, engine, version, lod):
+    if engine != 'objects':
+        if lod:
+            pytest.skip("only the 'objects' engine has LOD")
+        pytest.importorskip('numpy')
+    clique.LOD = lod
+    path = str(tmp_path / 'world.clqs')
+    world = clique.World(NUM_SHAPES, seed=SEED, engine=engine,
+                         shape_class=POLICIES[version])
+    try:
+        scatter(world)
+        run(world, TICKS)
+        world.save(path)
+        expected = run(world, TICKS, TICKS)
+    finally:
+        world.close()
+
+    world = clique.World(snapshot_path=path, engine=engine,
+                         shape_class=POLICIES[version])
+    try:
+        assert world.ticks == TICKS
+        assert run(world, TICKS, TICKS) == expected
+    finally:
+        world.close()
+
+def test_load_other_policy(tmp_path):
+    # a snapshot only loads into the shape class that saved it
+    path = str(tmp_path / 'world.clqs')
+    world = clique.World(NUM_SHAPES, seed=SEED, shape_class=POLICIES[1])
+    world.save(path)
+    world.close()
+    with pytest.raises(AssertionError):
+        clique.World(snapshot_path=path)
+
+@pytest.mark.parametrize('version', [1, 2])
+@pytest.mark.parametrize('engine', ['numpy', 'parallel'])
+def test_policy_engine(version, engine):
+    # the array engines only know Version 3's rules, so a world of any other
+    # policy refuses to run on them rather than quietly running Version 3
+    clique.ENGINE = engine
+    for engine in [engine, None]:
+        with pytest.raises(AssertionError):
+            clique.World(NUM_SHAPES, seed=SEED, engine=engine,
+                         shape_class=POLICIES[version])
+
+@pytest.mark.parametrize('version', [1, 2, 3])
+def test_shapes_have_no_dict(version):
+    # every policy keeps Shape's slots, so a crowd doesn't carry a __dict__
+    # per shape
+    world = clique.World(NUM_SHAPES, seed=SEED, shape_class=POLICIES[version])
+    for shape in world.shapes:
+        assert not hasattr(shape, '__dict__')
+        if shape.persona is not None:
+            assert not hasattr(shape.persona, '__dict__')
+
+def test_chunks_keep_policy_state(tmp_path):
+    # a Version 1 shape's persona and direction survive being paged out
+    clique.CHUNKS = True
+    world = clique.World(NUM_SHAPES, seed=SEED, shape_class=POLICIES[1])
+    store = ChunkStore(str(tmp_path), clique.chunk_record(POLICIES[1]))
+    try:
+        for shape in world.shapes[:-1]:
+            shape.direction = clique.LEFT
+            record = clique.freeze_shape(shape)
+            thawed = world.thaw_shape(record)
+            assert clique.freeze_shape(thawed) == record
+            assert ((thawed.persona.rgb_tolerance,
+                     thawed.persona.personal_space, thawed.direction) ==
+                    (shape.persona.rgb_tolerance,
+                     shape.persona.personal_space, clique.LEFT))
+            store.save((999, 999), [record])
+            assert store.load((999, 999)) == [record]
+    finally:
+        world.close()
+
+
+@pytest.mark.parametrize('magic', [0, 0.25, 0.5, 0.8, 5 / 4])
+def test_generate_shapes(monkeypatch, magic):
+    # the batch picks types as often as choose_shape does, one at a time
+    monkeypatch.setattr(clique, 'MAGIC_CONSTANT', magic)
+    clique.RAND.seed(SEED)
+    n = 20000
+    population = clique.generate_shapes(n)
+    picked = [clique.choose_shape() for i in range(n)]
+    for shape_type, chance in zip(clique.SHAPE_TYPES, clique.type_chances()):
+        # (within four standard deviations, for both)
+        slack = 4 * (chance * (1 - chance) / n) ** 0.5 + 1e-9
+        generated = sum(shape.shape_type == shape_type
+                        for shape in population)
+        assert abs(generated / n - chance) <= slack, shape_type
+        assert abs(picked.count(shape_type) / n - chance) <= slack, shape_type
+
+    assert all(0 <= shape.shade < 255 and 0 <= shape.age < clique.MAX_AGE and
+               shape.side_length >= 0 for shape in population)
+
+
+def test_headless():
+    # a world that is stepped but never drawn loads neither pygame nor numpy
+    # (checked in a fresh interpreter, since this one has both by now)
+    code = ('import sys, clique\n'
+            'world = clique.World(50, seed=1)\n'
+            'for i in range(20): world.tick()\n'
+            'assert "pygame" not in sys.modules, "pygame"\n'
+            'assert "numpy" not in sys.modules, "numpy"\n')
+    subprocess.check_call([sys.executable, '-c', code])
+
+def test_settings_after_import(tmp_path):
+    # World reads its defaults when it's made, not when clique was imported
+    clique.NUM_SHAPES = 40
+    clique.ENGINE = 'numpy'
+    clique.RECORD_PATH = str(tmp_path / 'run.clqr')
+    pytest.importorskip('numpy')
+    world = clique.World(seed=SEED)
+    try:
+        assert len(world.shapes) == 40 + 1
+        assert world.engine is not None
+        world.tick()
+    finally:
+        world.close()
+    assert (tmp_path / 'run.clqr').exists()
+    clique.RAND.seed(SEED)
+    assert len(clique.generate_shapes()) == 40
+
+
+def crowds(np, rng, n):
+    # (x, y) arrays of n points: spread over the screen, packed into a few
+    # tight clumps far apart, and a clump with one stray far away
+    clumps = rng.integers(-5000, 5000, (2, 10)).repeat(n // 10, axis=1)
+    clumps += rng.integers(0, 30, clumps.shape)
+    stray = rng.integers(0, 40, (2, n))
+    stray[:, -1] = [10 ** 6, 7]
+    return [tuple(rng.integers(0, 800, (2, n))), tuple(clumps), tuple(stray)]
+
+@pytest.mark.parametrize('cell_size, max_pairs, max_rings',
+                         [(None, 1 << 18, 8), (7, 1 << 18, 8),
+                          (None, 50, 8), (None, 1 << 18, 0)])
+def test_nearest_neighbours(monkeypatch, cell_size, max_pairs, max_rings):
+    # whatever the cells and batches, the same answer as comparing every
+    # query with every point (ties going to the lowest index)
+    np = pytest.importorskip('numpy')
+    import clique_numpy
+    monkeypatch.setattr(clique_numpy, 'MAX_PAIRS', max_pairs)
+    monkeypatch.setattr(clique_numpy, 'MAX_RINGS', max_rings)
+    rng = np.random.default_rng(SEED)
+    for px, py in crowds(np, rng, 600):
+        qx = np.append(px, rng.integers(-6000, 6000, 50))
+        qy = np.append(py, rng.integers(-6000, 6000, 50))
+        qself = np.append(np.arange(len(px)), np.full(50, -1))
+        found = clique_numpy.nearest_neighbours(qx, qy, qself, px, py,
+                                                cell_size)
+        dist = np.abs(qx[:, None] - px) + np.abs(qy[:, None] - py)
+        dist[qself >= 0, qself[qself >= 0]] = dist.max() + 1
+        index = dist.argmin(axis=1)
+        assert (found[0] == index).all()
+        assert (found[1] == qx - px[index]).all()
+        assert (found[2] == qy - py[index]).all()
+        assert (found[3] == dist.min(axis=1)).all()
+
+def test_nearest_neighbours_memory():
+    # 20000 shapes on one screen, or bunched up, don't take more than a few
+    # megabytes to search (a cell size that didn't fit the crowd used to
+    # take most of a gigabyte)
+    np = pytest.importorskip('numpy')
+    import tracemalloc
+    import clique_numpy
+    rng = np.random.default_rng(SEED)
+    n = 20000
+    for px, py in crowds(np, rng, n):
+        tracemalloc.start()
+        try:
+            clique_numpy.nearest_neighbours(px, py, np.arange(n), px, py)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert peak < 48 << 20
+
+
+def test_sprites(monkeypatch):
+    # a shape blitted from its sprite comes out exactly as it does drawn in
+    # place, at every size, wherever it is in the world
+    monkeypatch.setattr(clique, 'OFFSET', [0, 0])
+    clique.load_pygame()
+    rand = random.Random(SEED)
+    drawn = pygame.Surface((200, 200))
+    blitted = pygame.Surface((200, 200))
+    for side_length in range(1, 91):
+        for shape_type in clique.SHAPE_TYPES:
+            shift = rand.choice([0, 1, -37, 1000, -12345, 10 ** 6])
+            clique.OFFSET[:] = [shift, -shift]
+            x = rand.randint(90, 110)
+            y = rand.randint(90, 110)
+            shape = clique.Shape((x - shift, y + shift), shape_type,
+                                 side_length, rand.randint(0, 254),
+                                 clique.PERSONALITIES[shape_type], 0)
+            drawn.fill(clique.WHITE)
+            shape.render(drawn)
+            blitted.fill(clique.WHITE)
+            blitted.blit(*shape.sprite())
+            assert (pygame.image.tostring(drawn, 'RGB') ==
+                    pygame.image.tostring(blitted, 'RGB')), \
+                (shape_type, side_length, shift)
+
+
+def test_main_steps(monkeypatch, tmp_path):
+    # the game's main loop steps the world just as tick does, recording
+    # every step, however many it has to catch up on between frames
+    monkeypatch.setenv('SDL_VIDEODRIVER', 'dummy')
+    period = 25
+    frames = [0]
+    def get_events():
+        frames[0] += 1
+        if frames[0] > 20:
+            return [pygame.event.Event(pygame.QUIT)]
+        return []
+    monkeypatch.setattr(pygame.event, 'get', get_events)
+    # (each frame takes one to three periods)
+    monkeypatch.setattr(pygame.time, 'get_ticks',
+                        lambda: sum(period * (1 + i % 3)
+                                    for i in range(frames[0])))
+
+    path = str(tmp_path / 'world.rec')
+    world = clique.World(NUM_SHAPES, seed=SEED, record_path=path)
+    try:
+        clique_main_3.main(world, period)
+        played = state(world)
+    finally:
+        world.close()
+    assert world.ticks > 20
+
+    recording = Replay(path)
+    try:
+        assert len(recording) == world.ticks + 1
+    finally:
+        recording.close()
+    world = clique.World(NUM_SHAPES, seed=SEED)
+    for tick in range(len(recording) - 1):
+        world.tick()
+    assert state(world) == played
+
+
+def test_main_idles(monkeypatch):
+    # with nothing to catch up on, the game sleeps between steps instead of
+    # drawing frame after frame
+    monkeypatch.setenv('SDL_VIDEODRIVER', 'dummy')
+    period = 25
+    frames = []
+    def get_events():
+        frames.append(pygame.time.get_ticks())
+        if frames[-1] - frames[0] >= 10 * period:
+            return [pygame.event.Event(pygame.QUIT)]
+        return []
+    monkeypatch.setattr(pygame.event, 'get', get_events)
+    world = clique.World(NUM_SHAPES, seed=SEED)
+    try:
+        clique_main_3.main(world, period)
+    finally:
+        world.close()
+    assert len(frames) <= 10 + 3
+
+def test_main_closes_csv(monkeypatch, tmp_path):
+    # every frame logged to the profiler's CSV file is there once the game
+    # has quit
+    monkeypatch.setenv('SDL_VIDEODRIVER', 'dummy')
+    frames = [0]
+    def get_events():
+        frames[0] += 1
+        if frames[0] > 20:
+            return [pygame.event.Event(pygame.QUIT)]
+        return []
+    monkeypatch.setattr(pygame.event, 'get', get_events)
+
+    path = tmp_path / 'profile.csv'
+    clique.profiler.toggle_csv(str(path))
+    world = clique.World(NUM_SHAPES, seed=SEED)
+    try:
+        clique_main_3.main(world, 25)
+        assert clique.profiler.csv is None
+        assert len(path.read_text().splitlines()) == 1 + 20
+    finally:
+        world.close()
+        clique.profiler.close()
+
+def test_profiler(monkeypatch):
+    # a phase's times are added up over each frame, and the stats and the
+    # histogram cover the last `window` frames
+    now = [0.0]
+    monkeypatch.setattr(clique_profile, 'clock', lambda: now[0])
+    profiler = clique_profile.Profiler(['move', 'age'], window=4,
+                                       always=True)
+    assert profiler.stats('move') == (0.0, 0.0, 0.0)
+    for ms in [1, 3, 0.25, 40, 7]:
+        for part in [ms / 4, ms * 3 / 4]:
+            profiler.start('move')
+            now[0] += part / 1000
+            profiler.stop('move')
+        profiler.end_frame()
+    assert list(profiler.history['move']) == pytest.approx([3, 0.25, 40, 7])
+    assert profiler.stats('move') == pytest.approx((12.5625, 40, 40))
+    assert profiler.histogram('move') == [1, 0, 0, 1, 1, 0, 0, 1]
+    assert profiler.stats('age') == (0.0, 0.0, 0.0)
+    assert profiler.histogram('age') == [4, 0, 0, 0, 0, 0, 0, 0]
+
+def test_main_twice_with_overlay(monkeypatch):
+    # the overlay's font goes with the pygame session it was made in, so a
+    # second game in the same process makes a new one
+    monkeypatch.setenv('SDL_VIDEODRIVER', 'dummy')
+    for game in range(2):
+        frames = [0]
+        def get_events():
+            frames[0] += 1
+            if frames[0] == 1:
+                return [pygame.event.Event(
+                    pygame.KEYDOWN, key=clique_main_3.PROFILE_OVERLAY_KEY)]
+            if frames[0] > 3:
+                return [pygame.event.Event(pygame.QUIT)]
+            return []
+        monkeypatch.setattr(pygame.event, 'get', get_events)
+        world = clique.World(NUM_SHAPES, seed=SEED)
+        try:
+            clique_main_3.main(world, 25)
+        finally:
+            world.close()
+            if clique.profiler.overlay:
+                clique.profiler.toggle_overlay()
+        assert clique.profiler.font is None
+
+
+@pytest.mark.parametrize('version', [1, 2, 3])
+def test_bench_one_shape(version):
+    # a shape on its own has no nearest neighbour to measure
+    import clique_bench
+    result = clique_bench.run(version, 'objects', 1, ticks=3)
+    assert result['shapes'] == 1 and result['nearest_px'] == 0
+
+
+def test_lod_smooth():
+    # with LOD on, shapes on the screen never move more than one pixel a
+    # tick, not even just after being born there (or thawed) from a shape
+    # that last moved far away, or long ago
+    clique.LOD = True
+    world = clique.World(NUM_SHAPES, seed=SEED)
+    scatter(world)
+    born = 0
+    for tick in range(TICKS):
+        if tick % 5 == 0:
+            clique.move_player(PLAYER_MOVES[tick // 5 % len(PLAYER_MOVES)])
+        before = dict((shape, tuple(shape.pos)) for shape in world.shapes)
+        world.tick()
+        for shape in world.visible_shapes():
+            if shape.age == 0:
+                born += 1 # (just respawned, from wherever it was)
+            else:
+                x, y = before[shape]
+                assert abs(shape.pos[0] - x) + abs(shape.pos[1] - y) <= 1
+    assert born
+
+    shape = world.shapes[0]
+    thawed = world.thaw_shape(clique.freeze_shape(shape))
+    assert thawed.updated == clique.scheduler.tick
+
+@pytest.mark.parametrize('engine', ['numpy', 'parallel'])
+def test_array_engine_ignores_lod_and_chunks(engine):
+    pytest.importorskip('numpy')
+    clique.LOD = True
+    clique.CHUNKS = True
+    with pytest.warns(UserWarning, match='LOD and CHUNKS'):
+        world = clique.World(NUM_SHAPES, seed=SEED, engine=engine)
+    world.close()
+
+def test_record_chunks(tmp_path):
+    # a paged world can't be recorded, and says so before it starts
+    clique.CHUNKS = True
+    with pytest.raises(AssertionError):
+        clique.World(NUM_SHAPES, seed=SEED,
+                     record_path=str(tmp_path / 'world.rec'))
+    assert not (tmp_path / 'world.rec').exists()
+
+def test_grid_and_sprites_after_import():
+    # the grid's cell size and the sprite cache's size are read when a world
+    # is made, too; the cell size changes nothing but the speed
+    expected = simulate()
+    assert simulate(GRID_CELL_SIZE=7) == expected
+    assert clique.grid.cell_size == 7
+    clique.SPRITE_CACHE_SIZE = 3
+    world = clique.World(NUM_SHAPES, seed=SEED)
+    for tick in range(5):
+        world.tick(pygame.Surface(clique.size))
+    assert len(clique.sprites.sprites) == 3
@@ -0,0 +1,135 @@
+"""
+Tests for clique_spatial: every query has to give exactly what a linear scan
+over the same items, in the order they were inserted, would.
+
+    python -m pytest -q test_spatial.py
+"""
+
+from __future__ import division, print_function
+import random
+import pytest
+from clique_spatial import SpatialGrid, fit_cell_size, CELL_SIZE
+
+SEED = 5
+
+
+def points(rand, n, spread):
+    # n (item, x, y) triples, with some piled up on the same spot so that
+    # ties come up
+    found = []
+    for i in range(n):
+        if found and rand.random() < 0.1:
+            x, y = found[rand.randrange(len(found))][1:]
+        else:
+            x = rand.randint(-spread, spread)
+            y = rand.randint(-spread, spread)
+        found.append((i, x, y))
+    return found
+
+def scan_nearest(items, x, y, exclude=None):
+    # what Shape.move used to do: the first item at the smallest manhattan
+    # distance
+    best = None
+    for item, ix, iy in items:
+        if item == exclude: continue
+        xdist = x - ix
+        ydist = y - iy
+        totaldist = abs(xdist) + abs(ydist)
+        if best is None or totaldist < best[3]:
+            best = (item, xdist, ydist, totaldist)
+    return best
+
+@pytest.mark.parametrize('n, spread, cell_size', [(1, 50, 100),
+                                                  (40, 30, 100),
+                                                  (300, 2000, 100),
+                                                  (300, 300, 7)])
+def test_nearest(n, spread, cell_size):
+    rand = random.Random(SEED)
+    items = points(rand, n, spread)
+    grid = SpatialGrid(cell_size)
+    grid.rebuild((item, x, y, 0) for item, x, y in items)
+    for item, x, y in items:
+        assert grid.nearest(x, y, exclude=item) == \
+               scan_nearest(items, x, y, item)
+    for i in range(200):
+        x = rand.randint(-2 * spread, 2 * spread)
+        y = rand.randint(-2 * spread, 2 * spread)
+        assert grid.nearest(x, y) == scan_nearest(items, x, y)
+
+def test_empty():
+    grid = SpatialGrid()
+    assert grid.nearest(0, 0) is None
+    grid.insert('only', 10, 10)
+    assert grid.nearest(10, 10, exclude='only') is None
+
+def test_query_rect():
+    # everything that reaches into the rectangle has to be found, in
+    # insertion order; a few things that don't quite reach it may be too
+    rand = random.Random(SEED)
+    items = [(item, x, y, rand.randint(0, 80))
+             for item, x, y in points(rand, 500, 1500)]
+    grid = SpatialGrid()
+    grid.rebuild(items)
+    for i in range(200):
+        left = rand.randint(-1600, 1400)
+        top = rand.randint(-1600, 1400)
+        right = left + rand.randint(0, 800)
+        bottom = top + rand.randint(0, 600)
+        found = grid.query_rect(left, top, right, bottom)
+        assert found == sorted(found)
+        reaching = [item for item, x, y, radius in items
+                    if left - radius <= x <= right + radius and
+                       top - radius <= y <= bottom + radius]
+        assert set(reaching) <= set(found)
+
+@pytest.mark.parametrize('cell_size', [100, 7])
+def test_query_radius(cell_size):
+    # the same items, offsets and squared distances, in the same order, as a
+    # scan for everything strictly inside the circle
+    rand = random.Random(SEED)
+    items = points(rand, 500, 1500)
+    grid = SpatialGrid(cell_size)
+    grid.rebuild((item, x, y, 0) for item, x, y in items)
+    for i in range(400):
+        if i % 2:
+            x = rand.randint(-1600, 1600)
+            y = rand.randint(-1600, 1600)
+            radius = rand.choice([0, 1, 50, 100, 250, rand.randint(0, 900)])
+        else:
+            # exactly radius away from some item, which mustn't be found
+            k = rand.randint(1, 60)
+            x, y = items[rand.randrange(len(items))][1:]
+            x += 3 * k
+            y -= 4 * k
+            radius = 5 * k
+        scanned = []
+        for item, ix, iy in items:
+            xdist = x - ix
+            ydist = y - iy
+            squared = xdist * xdist + ydist * ydist
+            if squared < radius * radius:
+                scanned.append((item, xdist, ydist, squared))
+        assert grid.query_radius(x, y, radius) == scanned
+    assert SpatialGrid().query_radius(0, 0, 100) == []
+
+def test_coverage():
+    grid = SpatialGrid(10)
+    assert grid.coverage(0, 0, 100, 100) == 0
+    grid.insert('a', 0, 0)
+    grid.insert('b', 99, 49)
+    # the occupied cells are 10 by 5
+    assert grid.coverage(-500, -500, 500, 500) == 1
+    assert grid.coverage(0, 0, 49, 49) == 0.5
+    assert grid.coverage(0, 0, 9, 9) == 0.02
+    assert grid.coverage(200, 0, 300, 49) == 0
+
+def test_fit_cell_size():
+    # the cells shrink as the crowd grows, and as it bunches up
+    rand = random.Random(SEED)
+    def fitted(n, spread):
+        found = points(rand, n, spread)
+        return fit_cell_size([item[1] for item in found],
+                             [item[2] for item in found])
+    assert fitted(100, 500) > fitted(5000, 500) >= 1
+    assert fitted(1000, 500) > fitted(1000, 50)
+    assert fit_cell_size([], []) == CELL_SIZE